@@ -1,6 +1,11 @@
 from collections import deque
 from enum import Enum, auto
-import RPi.GPIO as GPIO
+import pygame as pg
+try:
+    import RPi.GPIO as GPIO
+except ImportError:
+    # not on a Raspberry Pi, the pins below can still be bound to actions
+    GPIO = None
 
 # Hier die Stecker einfügen, die beim RPi verwendet werden sollen
 CROSS_UP = 0
@@ -12,6 +17,9 @@ EXTRA_B = 5
 
 events = deque()
 
+# posted for every button event, so loops sleeping in `pygame.event.wait` wake up
+WAKE_UP = pg.event.custom_type()
+
 
 class EventType(Enum):
     BUTTON_UP = auto()
@@ -20,12 +28,42 @@ class EventType(Enum):
 
 class _ButtonEvent:
 
-    def __init__(self, type, **attrs):
-        self.__dict__.update(**attrs)
-        self._type = type
+    __slots__ = ('type', 'button')
+
+    def __init__(self, type, button):
+        self.type = type
+        self.button = button
 
     def __eq__(self, value):
-        return self._type == value
+        return self.type == value
+
+
+# button events carry no state besides type and button, so one instance
+# per combination is shared instead of creating a new one on every press
+_event_pool = {}
+_wake_up_event = None
+
+
+def _pooled_event(type, button):
+    event = _event_pool.get((type, button))
+    if event is None:
+        event = _event_pool[type, button] = _ButtonEvent(type, button)
+    return event
+
+
+def _push(event):
+    global _wake_up_event
+    events.append(event)
+    if _wake_up_event is None:
+        _wake_up_event = pg.event.Event(WAKE_UP)
+    pg.event.post(_wake_up_event)
+
+
+def _on_edge(channel):
+    # the pins are pulled up and the buttons pull them to ground,
+    # so a pin that reads low is pressed
+    type = EventType.BUTTON_DOWN if not GPIO.input(channel) else EventType.BUTTON_UP
+    _push(_pooled_event(type, channel))
 
 
 def init():
@@ -40,16 +78,12 @@ def init():
     ]
     GPIO.setup(buttons, GPIO.IN, GPIO.PUD_UP)
     for button in buttons:
-       GPIO.add_event_detect(
-            button,
-            GPIO.RISING,
-            callback=lambda b=button: events.append(_ButtonEvent(EventType.BUTTON_DOWN), button=b)
-        )
-       GPIO.add_event_detect(
-            button,
-            GPIO.FALLING,
-            callback=lambda b=button: events.append(_ButtonEvent(EventType.BUTTON_UP), button=b)
-        )
+        for type in EventType:
+            _pooled_event(type, button)
+    for button in buttons:
+        # a pin takes only one edge detection, so both edges go to one callback
+        # that reads the level to tell presses from releases
+        GPIO.add_event_detect(button, GPIO.BOTH, callback=_on_edge)
 
 
 def get_button_presses():
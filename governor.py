@@ -0,0 +1,162 @@
+import time
+from collections import deque, namedtuple
+
+QualityLevel = namedtuple('QualityLevel', 'fps outlines render_scale')
+QualityLevel.__doc__ = """
+One step of a game's quality ladder.
+
+:param fps: {int} target frame rate
+:param outlines: {bool} whether the drawers add outline passes
+:param render_scale: {float} internal resolution relative to the configured one
+"""
+
+
+class Decision(namedtuple('Decision', 'time old new frame_ms budget_ms')):
+    """
+    A change of the quality level and the measurement that caused it.
+    """
+
+    __slots__ = ()
+
+    def __str__(self):
+        return 'quality level {} -> {}: {:.1f} ms per frame, budget {:.1f} ms'.format(
+            self.old, self.new, self.frame_ms, self.budget_ms
+        )
+
+
+class FrameGovernor:
+    """
+    Steps a game up and down a ladder of `QualityLevel`s, depending on
+    how long its frames take compared to the budget of the current
+    level's frame rate.
+
+    Frame times are averaged over windows of `window` frames. A window
+    above `slow` times the budget steps down right away. Stepping up takes
+    `hold` windows in a row below `fast` times the budget of the better
+    level, and every step up that has to be taken back within a window
+    doubles the windows needed, up to `max_hold`, so a game on the edge
+    doesn't keep flapping between two levels. Once a step up lasts as
+    long as the game had to wait for it, the wait is back to `hold`.
+
+    A step down that doesn't lower the frame time relative to the budget
+    in the following window is taken back, and the level it went to is
+    skipped from then on, so a step that only costs quality (e.g. a lower
+    render resolution whose upscaling costs more than it saves) doesn't
+    drag the game further down the ladder.
+    """
+
+    def __init__(self, levels, level=0, min_level=0, max_level=None, window=30, slow=0.95, fast=0.6, hold=4,
+                 on_change=None, max_hold=64):
+        """
+        :param levels: {list<QualityLevel>} levels from best to cheapest
+        :param level: {int} index of the level to start with
+        :param min_level: {int} index of the best level that may be used
+        :param max_level: {int} index of the cheapest level that may be used, defaults to the last one
+        :param window: {int} frames per measurement
+        :param slow: {float} share of the budget above which the level goes down
+        :param fast: {float} share of the better level's budget below which the level may go up
+        :param hold: {int} good windows in a row needed before going up
+        :param on_change: {function} called with every `Decision`, e.g. `print`
+        :param max_hold: {int} most good windows in a row a flapping game has to wait for
+        """
+        self.levels = levels
+        self.min_level = min_level
+        self.max_level = len(levels) - 1 if max_level is None else max_level
+        self.level = min(max(level, self.min_level), self.max_level)
+        self.window = window
+        self.slow = slow
+        self.fast = fast
+        self.hold = hold
+        self.max_hold = max_hold
+        self.on_change = on_change
+        self.decisions = deque(maxlen=100)
+        self._total = 0
+        self._frames = 0
+        self._good_windows = 0
+        self._windows_since_up = None
+        self._hold = hold
+        self._stepped_down = None
+        self.skipped = set()
+
+    @property
+    def current(self):
+        return self.levels[self.level]
+
+    def frame(self, frame_ms):
+        """
+        Adds the time the last frame took, without the time spent waiting
+        for the next one (`pygame.time.Clock.get_rawtime`).
+
+        :param frame_ms: {float} milliseconds of work in the last frame
+        :return: {QualityLevel} the new level if it changed, else None
+        """
+        self._total += frame_ms
+        self._frames += 1
+        if self._frames < self.window:
+            return None
+        average = self._total / self._frames
+        self._total = 0
+        self._frames = 0
+        if self._windows_since_up is not None:
+            self._windows_since_up += 1
+            if self._windows_since_up > self._hold:
+                # the last step up held, the game isn't on the edge anymore
+                self._hold = self.hold
+                self._windows_since_up = None
+
+        budget = 1000 / self.current.fps
+        if self._stepped_down is not None:
+            old_level, old_share = self._stepped_down
+            self._stepped_down = None
+            if average / budget >= old_share:
+                # the step down didn't help, go back and leave this level out
+                self.skipped.add(self.level)
+                self._good_windows = 0
+                return self._change(old_level, average, budget)
+
+        if average > self.slow * budget:
+            self._good_windows = 0
+            cheaper = self._next_level(self.level, 1)
+            if cheaper is None:
+                return None
+            if self._windows_since_up == 1:
+                # the last step up didn't hold
+                self._hold = min(self._hold * 2, self.max_hold)
+            self._windows_since_up = None
+            self._stepped_down = self.level, average / budget
+            return self._change(cheaper, average, budget)
+
+        better = self._next_level(self.level, -1)
+        if better is None:
+            return None
+        better_budget = 1000 / self.levels[better].fps
+        if average >= self.fast * better_budget:
+            self._good_windows = 0
+            return None
+        self._good_windows += 1
+        if self._good_windows < self._hold:
+            return None
+        self._good_windows = 0
+        self._windows_since_up = 0
+        return self._change(better, average, better_budget)
+
+    def _next_level(self, level, step):
+        """
+        :param level: {int} index of the level to start from
+        :param step: {int} 1 for the next cheaper level, -1 for the next better one
+        :return: {int} index of the next level that isn't skipped, None if there is none
+        """
+        level += step
+        while self.min_level <= level <= self.max_level:
+            if level not in self.skipped:
+                return level
+            level += step
+        return None
+
+    def _change(self, level, frame_ms, budget_ms):
+        decision = Decision(time.time(), self.level, level, frame_ms, budget_ms)
+        self.decisions.append(decision)
+        self.level = level
+        if self.on_change is not None:
+            self.on_change(decision)
+        return self.levels[level]
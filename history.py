@@ -0,0 +1,82 @@
+import sys
+from collections import deque
+
+# what keeping one entry costs besides its payload: the bytes object and the deque slot
+_ENTRY_OVERHEAD = sys.getsizeof(b'') + 8
+
+
+class DeltaHistory:
+    """
+    Undo and redo history of encoded changes, limited by bytes instead
+    of entries.
+
+    Every entry is a `bytes` object holding only what one step changed,
+    e.g. the cells a click opened or the cells a snake's head and tail
+    moved to. What an entry means is up to the game, which also applies
+    it, so undoing or redoing a step costs as much as the step changed.
+
+    Entries live in two deques: the steps that can be undone and the
+    steps that were undone and can be redone. Once they go over
+    `byte_budget`, the oldest steps are dropped, so the history acts like
+    a ring buffer that keeps as many recent steps as fit. The latest step
+    is always kept, even if it's larger than the budget on its own.
+    """
+
+    def __init__(self, byte_budget=256 * 1024):
+        """
+        :param byte_budget: {int} bytes the entries may take up, overhead included
+        """
+        self.byte_budget = byte_budget
+        self.size = 0
+        self._undo = deque()
+        self._redo = deque()
+
+    def __len__(self):
+        return len(self._undo)
+
+    def push(self, entry):
+        """
+        Adds the step that just happened. Steps that could have been
+        redone are gone afterwards.
+
+        :param entry: {bytes} encoded changes of the step
+        :return: {None}
+        """
+        redo = self._redo
+        while redo:
+            self.size -= len(redo.pop()) + _ENTRY_OVERHEAD
+        undo = self._undo
+        undo.append(entry)
+        self.size += len(entry) + _ENTRY_OVERHEAD
+        # the oldest steps are dropped until the rest fits
+        while self.size > self.byte_budget and len(undo) > 1:
+            self.size -= len(undo.popleft()) + _ENTRY_OVERHEAD
+
+    def undo(self):
+        """
+        Takes back the latest step, it can be redone afterwards.
+
+        :return: {bytes} the entry to apply backwards, None if there is nothing to undo
+        """
+        if not self._undo:
+            return None
+        entry = self._undo.pop()
+        self._redo.append(entry)
+        return entry
+
+    def redo(self):
+        """
+        Repeats the latest undone step.
+
+        :return: {bytes} the entry to apply forwards, None if there is nothing to redo
+        """
+        if not self._redo:
+            return None
+        entry = self._redo.pop()
+        self._undo.append(entry)
+        return entry
+
+    def clear(self):
+        self._undo.clear()
+        self._redo.clear()
+        self.size = 0
@@ -0,0 +1,158 @@
+import math
+import pygame as pg
+
+
+class GlyphAtlas:
+    """
+    Renders the glyphs of `chars` once into a single surface, so text
+    made of them can be put together by blitting parts of that surface
+    instead of calling `font.render` every time it changes. All glyphs
+    get the same advance, so numbers don't jump around.
+    """
+
+    def __init__(self, font, color, background, chars='0123456789-:'):
+        glyphs = [font.render(char, True, color, background) for char in chars]
+        self.advance = max(glyph.get_width() for glyph in glyphs)
+        self.height = max(glyph.get_height() for glyph in glyphs)
+        self.background = background
+        self.surface = pg.Surface((self.advance * len(chars), self.height)).convert()
+        self.surface.fill(background)
+        self.rects = {}
+        for i, (char, glyph) in enumerate(zip(chars, glyphs)):
+            x = i * self.advance
+            self.surface.blit(glyph, (x + (self.advance - glyph.get_width()) // 2, 0))
+            self.rects[char] = pg.Rect(x, 0, self.advance, self.height)
+
+    def compose(self, text, target, right, y=0):
+        """
+        Blits `text` into `target`, right aligned at x = `right`.
+        Characters missing from the atlas are left blank.
+
+        :param text: {str} text to be drawn
+        :param target: {pygame.Surface} surface to draw on
+        :param right: {int} x coordinate the text ends at
+        :param y: {int} y coordinate of the top of the text
+        :return: {None}
+        """
+        x = right - len(text) * self.advance
+        for char in text:
+            rect = self.rects.get(char)
+            if rect is not None:
+                target.blit(self.surface, (x, y), rect)
+            x += self.advance
+
+
+class _HudField:
+
+    __slots__ = ('atlas', 'label', 'pos', 'digits', 'label_width', 'surface', 'text', 'changed')
+
+    def __init__(self, atlas, label, rendered_label, pos, digits):
+        self.atlas = atlas
+        self.label = label
+        self.pos = pos
+        self.digits = digits
+        self.label_width = rendered_label.get_width()
+        self.surface = pg.Surface((
+            self.label_width + atlas.advance * digits,
+            max(rendered_label.get_height(), atlas.height)
+        )).convert()
+        self.surface.fill(atlas.background)
+        self.surface.blit(rendered_label, (0, 0))
+        self.text = None
+        self.changed = True
+
+    def set(self, value):
+        text = str(value)
+        if len(text) > self.digits:
+            # dropping the leading digits would show a wrong number, the largest one that fits is closer
+            text = '-' + '9' * (self.digits - 1) if text.startswith('-') else '9' * self.digits
+        if text == self.text:
+            return
+        self.text = text
+        self.surface.fill(
+            self.atlas.background,
+            (self.label_width, 0, self.surface.get_width() - self.label_width, self.surface.get_height())
+        )
+        self.atlas.compose(text, self.surface, self.surface.get_width())
+        self.changed = True
+
+
+class Hud:
+    """
+    Score, timer and similar numbers drawn on top of a game. Every field
+    keeps a pre-composed surface that is only rebuilt from the glyph atlas
+    when its value changes, so drawing the HUD is one blit per field.
+    """
+
+    def __init__(self, display, size, color, background):
+        """
+        :param display: {utils.Display} display the HUD is drawn on
+        :param size: {int} logical font size
+        :param color: {pygame.Color} text color
+        :param background: {pygame.Color} color of the fields' background
+        """
+        self.display = display
+        self.size = size
+        self.font = pg.font.Font(None, display.length(size))
+        self.color = color
+        self.atlas = GlyphAtlas(self.font, color, background)
+        self.fields = {}
+        self._changed = []
+
+    def rebuild(self):
+        """
+        Renders font, atlas and fields again, after the display's internal
+        resolution changed.
+
+        :return: {None}
+        """
+        fields = self.fields
+        self.font = pg.font.Font(None, self.display.length(self.size))
+        self.atlas = GlyphAtlas(self.font, self.color, self.atlas.background)
+        self.fields = {}
+        for name, field in fields.items():
+            self.add(name, field.pos, field.label, field.digits, field.text)
+
+    def add(self, name, pos, label='', digits=3, value=0):
+        """
+        Adds a field showing up to `digits` characters after a fixed label.
+        Numbers that don't fit are shown as the largest one that does.
+
+        :param name: {str} name used with `set`
+        :param pos: {tuple<int>} logical position of the top left corner
+        :param label: {str} text in front of the value, rendered once
+        :param digits: {int} characters reserved for the value
+        :param value: {object} initial value
+        :return: {None}
+        """
+        rendered_label = self.font.render(label, True, self.color, self.atlas.background)
+        field = _HudField(self.atlas, label, rendered_label, pos, digits)
+        field.set(value)
+        self.fields[name] = field
+
+    def set(self, name, value):
+        self.fields[name].set(value)
+
+    def _logical_rect(self, field):
+        width, height = field.surface.get_size()
+        return pg.Rect(
+            field.pos,
+            (math.ceil(width / self.display.scale_x), math.ceil(height / self.display.scale_y))
+        )
+
+    def draw(self, surface):
+        """
+        Blits every field onto `surface`.
+
+        :param surface: {pygame.Surface} surface to draw on
+        :return: {list<pygame.Rect>} logical rects of the fields that changed since the last draw,
+                 the list is reused by the next call
+        """
+        changed = self._changed
+        changed.clear()
+        for field in self.fields.values():
+            surface.blit(field.surface, self.display.point(field.pos))
+            if field.changed:
+                field.changed = False
+                changed.append(self._logical_rect(field))
+        return changed
@@ -1,7 +1,22 @@
+import os
+import mmap
 import random
+import struct
+from array import array
+from operator import attrgetter
 from enum import Flag
+from functools import partialmethod
 import pygame as pg
-from utils import Vector2
+try:
+    import numpy as np
+except ImportError:
+    # only needed to save and load boards
+    np = None
+from utils import Vector2, Display, wait_for_events
+from hud import Hud
+from scenes import Scene, SceneMachine
+from profiler import SamplingProfiler
+from history import DeltaHistory
 
 
 class CellState(Flag):
@@ -13,17 +28,124 @@ class CellState(Flag):
     FLAGGED_MINE = MINED |FLAGGED
 
 
+_NEIGHBOR_DELTAS = (
+    (-1, -1), (-1, 0), (-1, 1),
+    (0, -1),           (0, 1),
+    (1, -1),  (1, 0),  (1, 1)
+)
+
+# state of a cell after opening it, flagged and open cells can't be opened
+_OPENED = {
+    CellState.EMPTY: CellState.OPEN,
+    CellState.MINED: CellState.OPEN_MINE,
+    CellState.OPEN_MINE: CellState.OPEN_MINE
+}
+
+# every cell state by its value, used when decoding deltas and save files
+_STATES = [CellState(value) for value in range(8)]
+_state_value = attrgetter('_value_')
+
+# mines left, flags placed, first click and alive before and after the changes
+_DELTA_HEADER = struct.Struct('<iiii4?')
+
+
 class MineSweeper:
 
-    def __init__(self, columns, rows, mines):
+    def __init__(self, columns, rows, mines, cells=None, hints=None):
+        """
+        :param columns: {int} width of the board
+        :param rows: {int} height of the board
+        :param mines: {int} number of mines
+        :param cells: {list<list<CellState>>} rows of cells to start from, defaults to an empty board
+        :param hints: {list<list<int>>} rows of hints matching `cells`, only needed once mines are placed
+        """
         self.columns = columns
         self.rows = rows
-        self.cells = [[CellState.EMPTY] * self.columns for _ in range(self.rows)]
+        self.cells = cells if cells is not None else [[CellState.EMPTY] * self.columns for _ in range(self.rows)]
+        if hints is not None:
+            self.hints = hints
         self.mines = mines
         self.cells_to_open = self.columns * self.rows - self.mines
         self.mines_left = self.mines
+        # unlike `mines_left`, this doesn't tell whether the flags are right
+        self.flags_placed = 0
         self.alive = True
         self.first_click = True
+        self.changes = None
+        self._tracked = None
+
+    def close(self):
+        """
+        Unmaps the save file a loaded board reads its rows from. Only for
+        boards that are done with, rows that weren't used yet are lost.
+
+        :return: {None}
+        """
+        if isinstance(self.cells, _MappedRows):
+            self.cells.close()
+
+    def _set(self, col, row, state):
+        changes = self.changes
+        if changes is not None:
+            changes.append((row * self.columns + col) << 6 | self.cells[row][col].value << 3 | state.value)
+        self.cells[row][col] = state
+
+    def track_changes(self):
+        """
+        Starts recording the cells changed by the following clicks, see `take_delta`.
+
+        :return: {None}
+        """
+        self.changes = array('I')
+        self._tracked = (self.mines_left, self.flags_placed, self.first_click, self.alive)
+
+    def take_delta(self):
+        """
+        Ends the recording and encodes what changed since `track_changes`:
+        a header with the counters before and after, followed by one
+        32 bit word per cell change holding the cell index, the old state
+        and the new state.
+
+        :return: {bytes} the changes, None if nothing changed
+        """
+        changes, self.changes = self.changes, None
+        if not changes:
+            return None
+        mines_left, flags_placed, first_click, alive = self._tracked
+        header = _DELTA_HEADER.pack(
+            mines_left, self.mines_left, flags_placed, self.flags_placed,
+            first_click, self.first_click, alive, self.alive
+        )
+        return header + changes.tobytes()
+
+    def apply_delta(self, delta, backward=False):
+        """
+        Redoes the changes encoded by `take_delta`, or undoes them if `backward`
+        is set. Only the changed cells are touched. The hints aren't part of the
+        delta, as undoing the first click brings back an empty board and the
+        next click places new mines anyway.
+
+        :param delta: {bytes} changes as returned by `take_delta`
+        :param backward: {bool} whether to undo instead of redo
+        :return: {None}
+        """
+        (mines_before, mines_after, flags_before, flags_after,
+         first_before, first_after, alive_before, alive_after) = _DELTA_HEADER.unpack_from(delta)
+        codes = array('I')
+        codes.frombytes(delta[_DELTA_HEADER.size:])
+        cells, columns = self.cells, self.columns
+        if backward:
+            for code in reversed(codes):
+                row, col = divmod(code >> 6, columns)
+                cells[row][col] = _STATES[code >> 3 & 7]
+            self.mines_left, self.flags_placed = mines_before, flags_before
+            self.first_click, self.alive = first_before, alive_before
+        else:
+            for code in codes:
+                row, col = divmod(code >> 6, columns)
+                cells[row][col] = _STATES[code & 7]
+            self.mines_left, self.flags_placed = mines_after, flags_after
+            self.first_click, self.alive = first_after, alive_after
 
     def _generate_mines(self, unavailable):
         self.hints = [[0] * self.columns for _ in range(self.rows)]
@@ -31,7 +153,7 @@ class MineSweeper:
         cells.remove(unavailable)
         for cell_num in random.choices(cells, k=self.mines):
             row, column = divmod(cell_num, self.columns)
-            self.cells[row][column] = CellState.MINED
+            self._set(column, row, CellState.MINED)
             for x, y in self._get_neighbors(column, row):
                 self.hints[y][x] += 1
 
@@ -46,26 +168,28 @@ class MineSweeper:
         self._open(col, row)
 
     def _open(self, col, row):
-        self[row][col] |= CellState.OPEN
-        if self[row][col] == CellState.OPEN_MINE:
-            self.alive = False
-            return
-        if self.get_hint((col, row)) == 0:
-            for neighbor in self._get_neighbors(col, row):
-                self.reveal_click(*neighbor)
+        # flood fill with an explicit stack, recursion would hit the limit on big boards
+        cells, hints, changes = self.cells, self.hints, self.changes
+        stack = [(col, row)]
+        while stack:
+            col, row = stack.pop()
+            state = cells[row][col]
+            opened = _OPENED.get(state)
+            if opened is None:
+                continue
+            if changes is not None:
+                changes.append((row * self.columns + col) << 6 | state.value << 3 | opened.value)
+            cells[row][col] = opened
+            if opened == CellState.OPEN_MINE:
+                self.alive = False
+                return
+            if hints[row][col] == 0:
+                stack.extend(self._get_neighbors(col, row))
 
     def _get_neighbors(self, col, row):
-        neighbors = [
-            Vector2(delta) for delta in
-            [
-                (-1, -1), (-1, 0), (-1, 1),
-                (0, -1),           (0, 1),
-                (1, -1),  (1, 0),  (1, 1)
-            ]
-        ]
         output = []
-        for neighbor in neighbors:
-            x, y = neighbor + Vector2(col, row)
+        for dx, dy in _NEIGHBOR_DELTAS:
+            x, y = col + dx, row + dy
             if 0 <= x < self.columns and 0 <= y < self.rows:
                 output.append((x, y))
         return output
@@ -74,7 +198,8 @@ class MineSweeper:
         state = self[row][col]
         if state & CellState.OPEN == CellState.OPEN:
             return
-        self[row][col] ^= CellState.FLAGGED
+        self._set(col, row, state ^ CellState.FLAGGED)
+        self.flags_placed += -1 if state & CellState.FLAGGED == CellState.FLAGGED else 1
         if state == CellState.MINED:
             self.mines_left -= 1
         elif self[row][col] == CellState.MINED:
@@ -90,15 +215,202 @@ class MineSweeper:
         x, y = pos
         return self.hints[y][x]
 
-    def enumerate(self):
-        for y in range(self.rows):
-            for x in range(self.columns):
-                yield Vector2(x, y), self[y][x]
+    def enumerate(self, columns=None, rows=None):
+        """
+        Yields the position and state of every cell, or only of the cells
+        within the given column and row ranges.
+
+        :param columns: {range} columns to visit, defaults to all
+        :param rows: {range} rows to visit, defaults to all
+        :return: {generator<tuple<Vector, CellState>>} positions and states
+        """
+        columns = columns or range(self.columns)
+        rows = rows or range(self.rows)
+        for y in rows:
+            row = self.cells[y]
+            for x in columns:
+                yield Vector2(x, y), row[x]
 
     def __getitem__(self, item):
         return self.cells[item]
 
 
+# Save files start with a header padded to `_SAVE_HEADER_SIZE` bytes: magic, version,
+# flags, columns, rows, mines, mines left, cells to open, elapsed milliseconds and
+# flags placed.
+# Two planes follow, both with every row starting on a new byte: the visible state
+# of every cell in 2 bits (hidden, flagged or open, first cell in the high bits) and
+# whether it's mined in 1 bit. Hints aren't stored, they follow from the mines.
+_SAVE_MAGIC = b'MSWP'
+_SAVE_VERSION = 2
+_SAVE_HEADER = struct.Struct('<4sHHIIIiiQi')
+_SAVE_HEADER_SIZE = 64
+_FIRST_CLICK, _ALIVE = 1, 2
+
+
+def _save_layout(columns, rows):
+    state_stride = (columns + 3) // 4
+    mine_stride = (columns + 7) // 8
+    mine_offset = _SAVE_HEADER_SIZE + rows * state_stride
+    return state_stride, mine_stride, mine_offset
+
+
+class _MappedRows:
+    """
+    Stands in for the list of rows in `MineSweeper.cells` or `hints` of a
+    loaded board. Each row is decoded from the mapped file the first time
+    it's used and kept as a plain list from then on, so only the pages of
+    the rows that are looked at get read.
+    """
+
+    def __init__(self, rows, decode, planes=None, mapping=None):
+        self._rows = [None] * rows
+        self._decode = decode
+        self.planes = planes
+        self.mapping = mapping
+
+    def close(self):
+        self.planes = None
+        if self.mapping is not None:
+            self.mapping.close()
+            self.mapping = None
+
+    def is_loaded(self, row):
+        return self._rows[row] is not None
+
+    def __getitem__(self, row):
+        loaded = self._rows[row]
+        if loaded is None:
+            loaded = self._rows[row] = self._decode(row)
+        return loaded
+
+    def __setitem__(self, row, value):
+        self._rows[row] = value
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __iter__(self):
+        for row in range(len(self._rows)):
+            yield self[row]
+
+
+def save_board(board, path, elapsed_ms=0):
+    """
+    Writes `board` in the packed save format. Rows of a loaded board that
+    were never used are copied over without decoding them. The file is
+    replaced in one go, so a board can be saved to the file it was loaded from.
+
+    :param board: {MineSweeper} board to save
+    :param path: {str} file to write
+    :param elapsed_ms: {int} play time to store along with the board
+    :return: {None}
+    """
+    if np is None:
+        raise RuntimeError('saving needs numpy')
+    columns, rows = board.columns, board.rows
+    state_stride, mine_stride, _ = _save_layout(columns, rows)
+    state_plane = np.zeros((rows, state_stride), np.uint8)
+    mine_plane = np.zeros((rows, mine_stride), np.uint8)
+    codes = np.zeros(state_stride * 4, np.uint8)
+    mapped = board.cells.planes if isinstance(board.cells, _MappedRows) else None
+    for y in range(rows):
+        if mapped is not None and not board.cells.is_loaded(y):
+            state_plane[y] = mapped[0][y]
+            mine_plane[y] = mapped[1][y]
+            continue
+        values = np.frombuffer(bytes(map(_state_value, board.cells[y])), np.uint8)
+        # flagged and open are the 2nd and 3rd bit of the cell state
+        codes[:columns] = values >> 1 & 3
+        quads = codes.reshape(-1, 4)
+        state_plane[y] = quads[:, 0] << 6 | quads[:, 1] << 4 | quads[:, 2] << 2 | quads[:, 3]
+        mine_plane[y] = np.packbits(values & 1)
+    flags = (_FIRST_CLICK if board.first_click else 0) | (_ALIVE if board.alive else 0)
+    header = _SAVE_HEADER.pack(
+        _SAVE_MAGIC, _SAVE_VERSION, flags, columns, rows,
+        board.mines, board.mines_left, board.cells_to_open, elapsed_ms, board.flags_placed
+    )
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as file:
+        file.write(header.ljust(_SAVE_HEADER_SIZE, b'\0'))
+        file.write(state_plane.tobytes())
+        file.write(mine_plane.tobytes())
+    os.replace(temp_path, path)
+
+
+def _read_save_header(data, path):
+    """
+    Checks that `data` holds a complete save file of this version.
+
+    :return: {tuple} the header fields after magic and version
+    """
+    if len(data) < _SAVE_HEADER_SIZE:
+        raise ValueError('{} is too short for a minesweeper save'.format(path))
+    magic, version, *fields = _SAVE_HEADER.unpack_from(data)
+    if magic != _SAVE_MAGIC or version != _SAVE_VERSION:
+        raise ValueError('{} is not a minesweeper save of version {}'.format(path, _SAVE_VERSION))
+    columns, rows = fields[1:3]
+    _, mine_stride, mine_offset = _save_layout(columns, rows)
+    if len(data) != mine_offset + rows * mine_stride:
+        raise ValueError('{} has the wrong size for its board'.format(path))
+    return fields
+
+
+def load_board(path):
+    """
+    Maps a save file into memory and returns a board backed by it. Rows
+    of cells and hints are only decoded once they're used, so opening a
+    huge board is instant and drawing a part of it reads only that part.
+    The file stays mapped until the board is closed.
+
+    :param path: {str} file written by `save_board`
+    :return: {tuple<MineSweeper, int>} the board and the stored play time in milliseconds
+    """
+    if np is None:
+        raise RuntimeError('loading needs numpy')
+    with open(path, 'rb') as file:
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        flags, columns, rows, mines, mines_left, cells_to_open, elapsed_ms, flags_placed = (
+            _read_save_header(data, path)
+        )
+    except ValueError:
+        data.close()
+        raise
+    state_stride, mine_stride, mine_offset = _save_layout(columns, rows)
+    planes = (
+        np.frombuffer(data, np.uint8, rows * state_stride, _SAVE_HEADER_SIZE).reshape(rows, state_stride),
+        np.frombuffer(data, np.uint8, rows * mine_stride, mine_offset).reshape(rows, mine_stride)
+    )
+
+    # the planes are only reached through `cells`, so closing it releases the mapping
+    def decode_cells(y):
+        state_plane, mine_plane = cells.planes
+        packed = state_plane[y]
+        codes = np.stack((packed >> 6, packed >> 4 & 3, packed >> 2 & 3, packed & 3), axis=1).reshape(-1)
+        values = codes[:columns] << 1 | np.unpackbits(mine_plane[y])[:columns]
+        return list(map(_STATES.__getitem__, values.tolist()))
+
+    def decode_hints(y):
+        top, bottom = max(0, y - 1), min(rows, y + 2)
+        mined = np.unpackbits(cells.planes[1][top:bottom], axis=1)[:, :columns]
+        around = mined.sum(axis=0)
+        hints = around.copy()
+        hints[1:] += around[:-1]
+        hints[:-1] += around[1:]
+        hints -= mined[y - top]
+        return hints.tolist()
+
+    cells = _MappedRows(rows, decode_cells, planes, data)
+    board = MineSweeper(columns, rows, mines, cells=cells, hints=_MappedRows(rows, decode_hints))
+    board.mines_left = mines_left
+    board.flags_placed = flags_placed
+    board.cells_to_open = cells_to_open
+    board.first_click = bool(flags & _FIRST_CLICK)
+    board.alive = bool(flags & _ALIVE)
+    return board, elapsed_ms
+
+
 class MineSweeperDrawer:
 
     def __init__(self, state_to_color, grid_line_color, crosshair_color, font, num_colors, game):
@@ -106,16 +418,21 @@ class MineSweeperDrawer:
         self.grid_line_color = grid_line_color
         self.crosshair_color = crosshair_color
         self.screen = game.screen
+        self.display = game.display
         self.game = game
         self.hint_surfaces = [font.render(str(num), 1, color)
                               for num, color
                               in zip(range(1, 10), num_colors)]
 
+    def _screen_pos(self, pos):
+        return (pos - self.game.camera.offset) * self.game.block_size
+
     def _block(self, pos):
-        return pg.Rect(pos * self.game.block_size, (self.game.block_size, self.game.block_size))
+        return self.display.rect(pg.Rect(self._screen_pos(pos), (self.game.block_size, self.game.block_size)))
 
     def _draw_cells(self):
-        for pos, state in self.game.board.enumerate():
+        columns, rows = self.game.camera.visible()
+        for pos, state in self.game.board.enumerate(columns, rows):
             pg.draw.rect(
                 self.screen,
                 self.state_to_color[state],
@@ -128,24 +445,28 @@ class MineSweeperDrawer:
         hint = self.game.board.get_hint(pos)
         if hint == 0: return
         surf = self.hint_surfaces[hint-1]
-        self.screen.blit(surf, pos * self.game.block_size)
+        self.screen.blit(surf, self.display.point(self._screen_pos(pos)))
 
     def _draw_grid_lines(self):
-        for i in range(self.game.board.columns):
-            start = i * self.game.block_size, 0
-            end = i * self.game.block_size, self.game.board.rows * self.game.block_size
-            pg.draw.line(self.screen, self.grid_line_color, start, end)
-        for i in range(self.game.board.rows):
-            start = 0, i * self.game.block_size
-            end = self.game.board.columns * self.game.block_size, i * self.game.block_size
-            pg.draw.line(self.screen, self.grid_line_color, start, end)
+        block_size = self.game.block_size
+        columns, rows = self.game.camera.visible()
+        width = len(columns) * block_size
+        height = len(rows) * block_size
+        for i in range(len(columns)):
+            start = i * block_size, 0
+            end = i * block_size, height
+            pg.draw.line(self.screen, self.grid_line_color, self.display.point(start), self.display.point(end))
+        for i in range(len(rows)):
+            start = 0, i * block_size
+            end = width, i * block_size
+            pg.draw.line(self.screen, self.grid_line_color, self.display.point(start), self.display.point(end))
 
     def _draw_crosshair(self):
-        center = self.game.block_size * self.game.selected_mine.get() + Vector2([self.game.block_size] * 2) // 2
+        center = self.game.block_size * (self.game.selected_mine.get() - self.game.camera.offset) + Vector2([self.game.block_size] * 2) // 2
         pg.draw.circle(
             self.screen,
             self.crosshair_color,
-            center,
+            self.display.point(center),
             2
         )
 
@@ -153,6 +474,7 @@ class MineSweeperDrawer:
         self._draw_cells()
         self._draw_grid_lines()
         self._draw_crosshair()
+        self.game.hud.draw(self.screen)
 
 
 class _2dSelector:
@@ -172,15 +494,82 @@ class _2dSelector:
         self.pos = (self.pos - other) % self.edges
         return self
 
+class _Camera:
+
+    def __init__(self, view_size, edges, margin=2):
+        self.view_size = view_size
+        self.edges = edges
+        self.margin = margin
+        self.offset = Vector2(0, 0)
+
+    def follow(self, pos):
+        """
+        Scrolls just far enough to keep `pos` at least `margin` cells
+        away from the border of the view.
+
+        :param pos: {Vector} cell that has to stay visible
+        :return: {None}
+        """
+        offset = []
+        for p, off, view, edge in zip(pos, self.offset, self.view_size, self.edges):
+            margin = min(self.margin, (view - 1) // 2)
+            off = min(off, p - margin)
+            off = max(off, p + margin + 1 - view)
+            offset.append(max(0, min(off, edge - view)))
+        self.offset = Vector2(offset)
+
+    def visible(self):
+        """
+        :return: {tuple<range>} columns and rows that are (partially) on screen
+        """
+        return tuple(
+            range(off, min(off + view + 1, edge))
+            for off, view, edge in zip(self.offset, self.view_size, self.edges)
+        )
+
+
 class MineSweeperGame:
 
     FPS = 25
     SCREEN_WIDTH, SCREEN_HEIGHT = 1600, 900
     SCREEN_SIZE = Vector2(SCREEN_WIDTH, SCREEN_HEIGHT)
+    SCENES = {
+        'playing': Scene(
+            keys={
+                pg.K_ESCAPE: 'quit',
+                pg.K_F12: 'toggle_profiler',
+                pg.K_SPACE: 'pause',
+                pg.K_w: 'select_up',
+                pg.K_a: 'select_left',
+                pg.K_s: 'select_down',
+                pg.K_d: 'select_right',
+                pg.K_o: 'reveal',
+                pg.K_p: 'flag',
+                pg.K_u: 'undo',
+                pg.K_r: 'redo',
+                pg.K_F5: 'save_game',
+                pg.K_F9: 'load_game'
+            }
+        ),
+        'paused': Scene(
+            keys={pg.K_ESCAPE: 'quit', pg.K_F12: 'toggle_profiler', pg.K_SPACE: 'resume'},
+            active=False
+        ),
+        'game_over': Scene(
+            keys={pg.K_ESCAPE: 'quit', pg.K_F12: 'toggle_profiler', pg.K_RETURN: 'restart', pg.K_u: 'undo',
+                  pg.K_F9: 'load_game'},
+            active=False
+        )
+    }
+    SAVE_PATH = 'minesweeper.sav'
 
-    def __init__(self, columns, rows, mines, block_size):
-        self.screen = pg.display.set_mode(self.SCREEN_SIZE, pg.FULLSCREEN)
+    def __init__(self, columns, rows, mines, block_size, render_size=None, smooth=False, hardware_scaling=False,
+                 idle_wait=True):
+        self.display = Display(self.SCREEN_SIZE, render_size, smooth, hardware_scaling)
+        self.screen = self.display.surface
         self.clock = pg.time.Clock()
+        # nothing changes without input, so the loop can sleep until a key is pressed
+        self.idle_wait = idle_wait
 
         self.drawer = MineSweeperDrawer(
             state_to_color={
@@ -193,7 +582,7 @@ class MineSweeperGame:
             },
             grid_line_color=pg.Color('black'),
             crosshair_color=pg.Color('blue'),
-            font=pg.font.SysFont('verdana.ttf', block_size),
+            font=pg.font.SysFont('verdana.ttf', self.display.length(block_size)),
             num_colors=[(  0,  65, 170),  # blue
                         ( 28, 122,   0),  # green
                         (183,  25,  25),  # red
@@ -208,32 +597,160 @@ class MineSweeperGame:
 
         self.board = MineSweeper(columns, rows, mines)
         self.selected_mine = _2dSelector(Vector2(0, 0), Vector2(columns, rows))
+        self.camera = _Camera(self.SCREEN_SIZE // block_size, Vector2(columns, rows))
+
+        self.started = None
+        self.finished = None
+        self.paused_at = None
+        self.history = DeltaHistory()
+        self.profiler = SamplingProfiler()
+        self.running = False
+        self.scenes = SceneMachine(self, self.SCENES, 'playing')
+        self.hud = Hud(self.display, 40, pg.Color('floralwhite'), pg.Color('gray20'))
+        self.hud.add('mines', (self.SCREEN_WIDTH - 320, 10), label='Mines ', value=mines)
+        self.hud.add('time', (self.SCREEN_WIDTH - 160, 10), label='Time ')
+
+    def elapsed_ms(self):
+        if self.started is None:
+            return 0
+        return (self.finished or self.paused_at or pg.time.get_ticks()) - self.started
+
+    def _update_hud(self):
+        if self.started is None and not self.board.first_click:
+            self.started = pg.time.get_ticks()
+        if self.started is not None and self.finished is None and (self.board.is_won() or self.board.is_lost()):
+            self.finished = pg.time.get_ticks()
+            self.scenes.switch('game_over')
+        # flags count whether they're right or not, the correct ones would give the mines away
+        self.hud.set('mines', self.board.mines - self.board.flags_placed)
+        self.hud.set('time', self.elapsed_ms() // 1000)
+
+    def idle_timeout(self):
+        """
+        :return: {float} seconds until the timer on the HUD changes, None if it's stopped
+        """
+        if self.started is None or not self.scenes.active:
+            return None
+        return (1000 - self.elapsed_ms() % 1000) / 1000
 
     def game_loop(self):
         self.drawer()
-        pg.display.update()
-        running = True
-        while running:
-            self.clock.tick(self.FPS)
-            for ev in pg.event.get():
-                if ev.type == pg.KEYDOWN:
-                    if ev.key == pg.K_w:
-                        self.selected_mine += Vector2(0, -1)
-                    elif ev.key == pg.K_a:
-                        self.selected_mine += Vector2(-1, 0)
-                    elif ev.key == pg.K_s:
-                        self.selected_mine += Vector2(0, 1)
-                    elif ev.key == pg.K_d:
-                        self.selected_mine += Vector2(1, 0)
-                    elif ev.key == pg.K_o:
-                        self.board.reveal_click(*self.selected_mine.get())
-                    elif ev.key == pg.K_p:
-                        self.board.flag_click(*self.selected_mine.get())
-                    elif ev.key == pg.K_ESCAPE:
-                        running = False
-                    self.drawer()
-                    pg.display.update()
+        self.display.present()
+        profiler = self.profiler
+        self.running = True
+        while self.running:
+            profiler.phase = 'wait'
+            if self.idle_wait:
+                events = wait_for_events(self.idle_timeout())
+            else:
+                self.clock.tick(self.FPS)
+                events = pg.event.get()
+            profiler.phase = 'input'
+            if self.scenes.handle_events(events):
+                profiler.phase = 'draw'
+                self.drawer()
+                profiler.phase = 'present'
+                self.display.present()
+            profiler.phase = 'hud'
+            self._update_hud()
+            changed = self.hud.draw(self.screen)
+            if changed:
+                self.display.present(changed)
+        profiler.stop()
+
+    def quit(self):
+        self.running = False
+
+    def toggle_profiler(self):
+        self.profiler.toggle()
+
+    def pause(self):
+        self.paused_at = pg.time.get_ticks()
+        self.scenes.switch('paused')
+
+    def resume(self):
+        # the time spent paused doesn't count
+        if self.started is not None:
+            self.started += pg.time.get_ticks() - self.paused_at
+        self.paused_at = None
+        self.scenes.switch('playing')
+
+    def restart(self):
+        self.board.close()
+        self.board = MineSweeper(self.board.columns, self.board.rows, self.board.mines)
+        self.history.clear()
+        self.started = None
+        self.finished = None
+        self.scenes.switch('playing')
+
+    def save_game(self):
+        try:
+            save_board(self.board, self.SAVE_PATH, self.elapsed_ms())
+        except (OSError, RuntimeError) as error:
+            print('could not save the game:', error)
+
+    def load_game(self):
+        # a broken or missing save leaves the running game as it is
+        try:
+            board, elapsed_ms = load_board(self.SAVE_PATH)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError, RuntimeError) as error:
+            print('could not load the game:', error)
+            return
+        self.board.close()
+        self.board = board
+        # the drawer only paints the board, a smaller one would leave the old one showing around it
+        self.screen.fill(pg.Color('black'))
+        edges = Vector2(self.board.columns, self.board.rows)
+        self.selected_mine = _2dSelector(Vector2(0, 0), edges)
+        self.camera = _Camera(self.SCREEN_SIZE // self.block_size, edges)
+        self.history.clear()
+        self.started = None if self.board.first_click else pg.time.get_ticks() - elapsed_ms
+        self.finished = None
+        self.scenes.switch('playing')
+
+    def move_selection(self, delta):
+        self.selected_mine += delta
+        self.camera.follow(self.selected_mine.get())
+
+    select_up = partialmethod(move_selection, Vector2(0, -1))
+    select_left = partialmethod(move_selection, Vector2(-1, 0))
+    select_down = partialmethod(move_selection, Vector2(0, 1))
+    select_right = partialmethod(move_selection, Vector2(1, 0))
+
+    def reveal(self):
+        self.board.track_changes()
+        self.board.reveal_click(*self.selected_mine.get())
+        self._remember()
+
+    def flag(self):
+        self.board.track_changes()
+        self.board.flag_click(*self.selected_mine.get())
+        self._remember()
+
+    def _remember(self):
+        delta = self.board.take_delta()
+        if delta is not None:
+            self.history.push(delta)
+
+    def undo(self):
+        delta = self.history.undo()
+        if delta is None:
+            return
+        self.board.apply_delta(delta, backward=True)
+        if self.finished is not None and not (self.board.is_won() or self.board.is_lost()):
+            # taking back the last click of a finished game lets it go on
+            self.finished = None
+            self.scenes.switch('playing')
+
+    def redo(self):
+        delta = self.history.redo()
+        if delta is not None:
+            self.board.apply_delta(delta)
 
 if __name__ == '__main__':
     pg.init()
-    MineSweeperGame(10, 10, 16, 80).game_loop()
+    game = MineSweeperGame(10, 10, 16, 80)
+    game.profiler.install_signal()
+    game.game_loop()
@@ -1,17 +1,29 @@
+import sys
 import math
 import time
 import random
+import struct
+from array import array
+from functools import partialmethod
 import pygame as pg
-from utils import Vector2, DIRECTION, Timer
+from utils import Vector2, DIRECTION, Timer, SpatialHash, Display, AllocationStats, wait_for_events
+from hud import Hud
+from scenes import Scene, SceneMachine
+from profiler import SamplingProfiler
+from history import DeltaHistory
+from governor import QualityLevel, FrameGovernor
 
 
 class Paddle:
 
+    __slots__ = ('_rect', 'x', '_y', 'width', 'height', 'max_y', 'min_y', 'speed', 'direction')
+
     UP = -1
     STAND = 0
     DOWN = 1
 
     def __init__(self, x, y, width, height, min_y, max_y, speed):
+        self._rect = pg.Rect(x, y, width, height)
         self.x = x
         self.y = y
         self.width = width
@@ -35,9 +47,18 @@ class Paddle:
     def pos(self):
         return self.x, self.y
 
+    @property
+    def y(self):
+        return self._y
+
+    @y.setter
+    def y(self, y):
+        self._y = y
+        self._rect.y = int(y)
+
     @property
     def rect(self):
-        return pg.Rect(self.pos, (self.width, self.height))
+        return self._rect
 
     @property
     def top(self):
@@ -50,6 +71,8 @@ class Paddle:
 
 class AIPaddle(Paddle):
 
+    __slots__ = ('ball',)
+
     def __init__(self, ball, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.ball = ball
@@ -64,36 +87,98 @@ class AIPaddle(Paddle):
 
 class Ball:
 
-    def __init__(self, pos, radius, speed, direction, min_y, max_y, colliders):
-        self.pos = pos
+    __slots__ = (
+        'radius', '_rect', '_test_rect', '_x', '_y',
+        'speed', 'direction', 'min_y', 'max_y', 'colliders', 'free_lane'
+    )
+
+    def __init__(self, pos, radius, speed, direction, min_y, max_y, colliders, free_lane=None):
         self.radius = radius
+        self._rect = pg.Rect(0, 0, radius * 2, radius * 2)
+        self._test_rect = self._rect.copy()
+        self.pos = pos
         self.speed = speed
         self.direction = direction
         self.min_y = min_y
         self.max_y = max_y - self.rect.height
         self.colliders = colliders
+        # x range between the colliders that none of them reaches into
+        self.free_lane = free_lane
 
     def update(self, dt):
-        dx, dy = self.speed * self.direction * dt
-        test_rect = self.rect
-        test_rect.x += dx
-        test_rect.y += dy
-        if test_rect.y <= self.min_y + 2*self.radius or test_rect.y >= self.max_y - 2*self.radius:
+        dx = self.speed * self.direction[0] * dt
+        dy = self.speed * self.direction[1] * dt
+        test_rect = self._test_rect
+        test_rect.x = self._rect.x + dx
+        test_rect.y = self._rect.y + dy
+        if (test_rect.y <= self.min_y + 2*self.radius and dy < 0
+                or test_rect.y >= self.max_y - 2*self.radius and dy > 0):
+            dy = -dy
             self.direction = self.direction.deflect_y()
         else:
-            collide_idx = test_rect.collidelist(self.colliders)
-            if collide_idx != -1:
-                collide_with = self.colliders[collide_idx]
+            collide_with = self._find_collider(test_rect)
+            if collide_with is not None:
                 if self.top >= collide_with.bottom or self.bottom <= collide_with.top:
                     dy = -dy
                     self.direction = self.direction.deflect_y()
                 else:
                     dx = -dx
                     self.direction = self.direction.deflect_x()
-        self.pos += Vector2(dx, dy)
+        self._move_to(self._x + dx, self._y + dy)
         if self.bottom > 900 or self.top < 0:
             print(locals())
 
+    def _find_collider(self, rect):
+        lane = self.free_lane
+        if lane is not None and lane[0] < rect.left and rect.right < lane[1]:
+            return None
+        collide_idx = rect.collidelist(self.colliders)
+        return None if collide_idx == -1 else self.colliders[collide_idx]
+
+    def collide_ball(self, other):
+        """
+        Resolves an elastic collision between two balls of equal mass by
+        exchanging the velocity components along the line between their
+        centers and pushing them apart so they don't stick together.
+
+        :param other: {Ball} ball that might overlap with this one
+        :return: {bool} whether the balls collided
+        """
+        nx = other._x - self._x
+        ny = other._y - self._y
+        dist_sq = nx*nx + ny*ny
+        min_dist = self.radius + other.radius
+        if dist_sq >= min_dist*min_dist or dist_sq == 0:
+            return False
+        dist = dist_sq ** 0.5
+        nx /= dist
+        ny /= dist
+
+        vx1, vy1 = self.speed * self.direction[0], self.speed * self.direction[1]
+        vx2, vy2 = other.speed * other.direction[0], other.speed * other.direction[1]
+        approach = (vx1 - vx2)*nx + (vy1 - vy2)*ny
+        if approach > 0:
+            self._set_velocity(vx1 - approach*nx, vy1 - approach*ny)
+            other._set_velocity(vx2 + approach*nx, vy2 + approach*ny)
+
+        push = (min_dist - dist) / 2
+        self._push_to(self._x - push*nx, self._y - push*ny)
+        other._push_to(other._x + push*nx, other._y + push*ny)
+        return True
+
+    def _push_to(self, x, y):
+        top = self.min_y + 2*self.radius
+        bottom = self.max_y - 2*self.radius
+        self._move_to(x, max(min(bottom + self.radius, y), top + self.radius))
+
+    def _set_velocity(self, vx, vy):
+        speed = (vx*vx + vy*vy) ** 0.5
+        if speed == 0:
+            self.direction = DIRECTION['NONE']
+            return
+        self.speed = speed
+        self.direction = Vector2(vx / speed, vy / speed)
+
     def add_collideable(self, collable):
         self.colliders.append(collable)
 
@@ -109,17 +194,31 @@ class Ball:
     def jump_to(self, pos):
         self.pos = pos
 
+    def _move_to(self, x, y):
+        self._x = x
+        self._y = y
+        self._rect.x = int(x - self.radius)
+        self._rect.y = int(y - self.radius)
+
+    @property
+    def pos(self):
+        return Vector2(self._x, self._y)
+
+    @pos.setter
+    def pos(self, pos):
+        self._move_to(pos[0], pos[1])
+
     @property
     def rect(self):
-        return pg.Rect(self.pos - Vector2(self.radius, self.radius), (self.radius * 2, self.radius * 2))
+        return self._rect
 
     @property
     def x(self):
-        return self.pos[0]
+        return self._x
 
     @property
     def y(self):
-        return self.pos[1]
+        return self._y
 
     @property
     def top(self):
@@ -136,45 +235,89 @@ class PongDrawer:
         self.bg_color = bg_color
         self.paddle_color = paddle_color
         self.ball_color = ball_color
+        self.outline_color = pg.Color('black')
         self.screen = game.screen
+        self.display = game.display
         self.game = game
+        self.paddles = (game.player, game.enemy)
+        self.outlines = True
+        self._scaled = pg.Rect(0, 0, 0, 0)
 
     def fill_screen(self, rects):
         for rect in rects:
-            self.screen.fill(self.bg_color, rect)
+            self.screen.fill(self.bg_color, self.display.rect(rect))
 
     def draw_bg(self):
         self.screen.fill(self.bg_color)
 
     def __call__(self):
         self.screen.fill(self.bg_color)
-        for paddle in [self.game.player, self.game.enemy]:
+        for paddle in self.paddles:
+            rect = self.display.rect(paddle.rect, self._scaled)
             pg.draw.rect(
                 self.screen,
                 self.paddle_color,
-                paddle.rect
+                rect
             )
-            pg.draw.rect(
+            if self.outlines:
+                pg.draw.rect(
+                    self.screen,
+                    self.outline_color,
+                    rect,
+                    1
+                )
+        radius = self.display.length(self.game.ball.radius)
+        for ball in self.game.balls:
+            pg.draw.circle(
                 self.screen,
-                pg.Color('black'),
-                paddle.rect,
-                1
+                self.ball_color,
+                self.display.point((math.floor(ball.x), math.floor(ball.y))),
+                radius
             )
-        pg.draw.circle(
-            self.screen,
-            self.ball_color,
-            math.floor(self.game.ball.pos),
-            self.game.ball.radius
-        )
+        self.game.dirty_rects += self.game.hud.draw(self.screen)
+
+
+# points of both sides, number of balls and how long the step after this state took,
+# followed by the y of both paddles and x, y, direction and speed of every ball as 32 bit floats
+_STATE_HEADER = struct.Struct('<3If')
 
 
 class PongGame:
 
     FPS = 60
     SCREEN_SIZE = SCREEN_WIDTH, SCREEN_HEIGHT = 1600, 900
-
-    def __init__(self):
-        self.screen = pg.display.set_mode(self.SCREEN_SIZE, pg.FULLSCREEN)
+    REWIND_BUDGET = 512 * 1024
+    # what the governor may step through when frames take too long, from best to cheapest.
+    # Pong draws a few rects, so upscaling a lower resolution costs more than it saves
+    QUALITY_LEVELS = (
+        QualityLevel(fps=60, outlines=True, render_scale=1),
+        QualityLevel(fps=60, outlines=False, render_scale=1),
+        QualityLevel(fps=45, outlines=False, render_scale=1),
+        QualityLevel(fps=30, outlines=False, render_scale=1)
+    )
+    # the paddle keys are bound while paused as well, so releasing
+    # a key during the pause doesn't leave the paddle moving
+    SCENES = {
+        'playing': Scene(
+            keys={pg.K_ESCAPE: 'quit', pg.K_F12: 'toggle_profiler', pg.K_p: 'pause', pg.K_BACKSPACE: 'rewind',
+                  pg.K_w: 'paddle_up', pg.K_s: 'paddle_down', pg.K_SPACE: 'print_ball'},
+            key_releases={pg.K_w: 'paddle_down', pg.K_s: 'paddle_up'}
+        ),
+        'paused': Scene(
+            keys={pg.K_ESCAPE: 'quit', pg.K_F12: 'toggle_profiler', pg.K_p: 'resume', pg.K_BACKSPACE: 'rewind',
+                  pg.K_w: 'paddle_up', pg.K_s: 'paddle_down'},
+            key_releases={pg.K_w: 'paddle_down', pg.K_s: 'paddle_up'},
+            active=False
+        )
+    }
+
+    def __init__(self, render_size=None, smooth=False, hardware_scaling=False, idle_wait=True,
+                 adaptive_quality=True):
+        self.display = Display(self.SCREEN_SIZE, render_size, smooth, hardware_scaling)
+        self.screen = self.display.surface
+        self.base_render_size = self.display.render_size
+        self.fps = self.FPS
+        self.governor = FrameGovernor(self.QUALITY_LEVELS) if adaptive_quality else None
         paddle_width = self.SCREEN_WIDTH // 90
         paddle_height = self.SCREEN_HEIGHT // 3
         self.player = Paddle(
@@ -209,6 +352,7 @@ class PongGame:
             speed=380
         )
         self.ball.add_collideable(self.enemy)
+        self.balls = [self.ball]
         self.drawer = PongDrawer(
             pg.Color('gray34'),
             pg.Color('gray20'),
@@ -216,88 +360,304 @@ class PongGame:
             self
         )
         self.points = {'player': 0, 'enemy': 0}
+        self.hud = Hud(self.display, 48, pg.Color('floralwhite'), pg.Color('gray34'))
+        self.hud.add('player', (self.SCREEN_WIDTH // 2 - 120, 10))
+        self.hud.add('enemy', (self.SCREEN_WIDTH // 2 + 40, 10))
         self.clock = pg.time.Clock()
         self.updateables = [
             self.player,
             self.enemy,
             self.ball,
-            Timer(5, self.randomize_ball)
+            Timer(5, self.randomize_balls)
         ]
         self.dirty_rects = []
+        self.allocation_stats = None
+        self.idle_wait = idle_wait
+        self.profiler = SamplingProfiler()
+        self.history = DeltaHistory(self.REWIND_BUDGET)
+        self.running = False
+        self.scenes = SceneMachine(self, self.SCENES, 'playing')
+        self._track_movers()
+
+    def _track_movers(self):
+        """
+        Sets up the rects that remember where the moving objects were
+        before and after each update, so these can be marked dirty
+        without allocating new rects every frame.
+        """
+        self.movers = [self.player, self.enemy] + self.balls
+        self._before = [mover.rect.copy() for mover in self.movers]
+        self._after = [mover.rect.copy() for mover in self.movers]
 
     def game_loop(self):
         self.drawer.draw_bg()
-        pg.display.update()
-        running = True
-        while running:
-            #dt = min(self.clock.tick(self.FPS) / 1000, 1/self.FPS + 0.002)
-            self.clock.tick(self.FPS)
-            dt = 1/self.FPS
-            for ev in pg.event.get():
-                if ev.type == pg.KEYDOWN:
-                    if ev.key == pg.K_ESCAPE:
-                        running = False
-                    elif ev.key == pg.K_w:
-                        self.player.add_direction(Paddle.UP)
-                    elif ev.key == pg.K_s:
-                        self.player.add_direction(Paddle.DOWN)
-                    elif ev.key == pg.K_SPACE:
-                        print(vars(self.ball))
-                if ev.type == pg.KEYUP:
-                    if ev.key == pg.K_w:
-                        self.player.add_direction(Paddle.DOWN)
-                    elif ev.key == pg.K_s:
-                        self.player.add_direction(Paddle.UP)
+        self.display.present()
+        profiler = self.profiler
+        self.running = True
+        while self.running:
+            if self.allocation_stats is not None:
+                self.allocation_stats.frame()
+            profiler.phase = 'wait'
+            if self.idle_wait and not self.scenes.active:
+                # paused, nothing moves until a key is pressed
+                events = wait_for_events()
+                self.clock.tick()
+            else:
+                #dt = min(self.clock.tick(self.fps) / 1000, 1/self.fps + 0.002)
+                self.clock.tick(self.fps)
+                events = pg.event.get()
+                if self.governor is not None:
+                    self._govern()
+            dt = 1/self.fps
+            profiler.phase = 'input'
+            self.scenes.handle_events(events)
+            if not self.scenes.active:
+                continue
+            profiler.phase = 'update'
             self.update(dt)
+            profiler.phase = 'draw'
+            self.drawer()
+            profiler.phase = 'present'
+            self.display.present(self.dirty_rects)
+            self.dirty_rects.clear()
+        profiler.stop()
+        if self.allocation_stats is not None:
+            print(self.allocation_stats.report())
+
+    def _govern(self):
+        level = self.governor.frame(self.clock.get_rawtime())
+        if level is not None:
+            self.apply_quality(level)
+
+    def apply_quality(self, level):
+        """
+        Switches to the frame rate, outlines and internal resolution of `level`.
+
+        :param level: {governor.QualityLevel} level to use
+        :return: {None}
+        """
+        self.fps = level.fps
+        self.drawer.outlines = level.outlines
+        width, height = self.base_render_size
+        if self.display.set_render_size((round(width * level.render_scale), round(height * level.render_scale))):
+            self.screen = self.drawer.screen = self.display.surface
+            self.hud.rebuild()
             self.drawer()
-            pg.display.update(self.dirty_rects)
-            self.dirty_rects = []
+            self.display.present()
+            self.dirty_rects.clear()
+
+    def quit(self):
+        self.running = False
+
+    def toggle_profiler(self):
+        self.profiler.toggle()
+
+    def pause(self):
+        self.scenes.switch('paused')
+
+    def resume(self):
+        self.scenes.switch('playing')
+
+    def move_paddle(self, direction):
+        self.player.add_direction(direction)
+
+    paddle_up = partialmethod(move_paddle, Paddle.UP)
+    paddle_down = partialmethod(move_paddle, Paddle.DOWN)
+
+    def print_ball(self):
+        print({name: getattr(self.ball, name) for name in Ball.__slots__})
+
+    def _snapshot(self, rects):
+        for rect, mover in zip(rects, self.movers):
+            rect.update(mover.rect)
+
+    def _pack_state(self, dt):
+        values = array('f', (self.player.y, self.enemy.y))
+        for ball in self.balls:
+            values.extend((ball.x, ball.y, ball.direction[0], ball.direction[1], ball.speed))
+        header = _STATE_HEADER.pack(self.points['player'], self.points['enemy'], len(self.balls), dt)
+        return header + values.tobytes()
+
+    def _unpack_state(self, state):
+        self.points['player'], self.points['enemy'], _, _ = _STATE_HEADER.unpack_from(state)
+        values = array('f')
+        values.frombytes(state[_STATE_HEADER.size:])
+        self.player.y, self.enemy.y = values[0], values[1]
+        for i, ball in enumerate(self.balls):
+            x, y, dx, dy, speed = values[2 + 5*i:7 + 5*i]
+            ball.jump_to((x, y))
+            ball.direction = Vector2(dx, dy)
+            ball.speed = speed
+
+    def rewind(self, seconds=1):
+        """
+        Puts paddles, balls and points back to where they were `seconds`
+        ago, as far as the history reaches.
+
+        :param seconds: {float} how far to go back
+        :return: {None}
+        """
+        state = None
+        rewound = 0
+        # the governor changes the frame rate, so the steps are counted by their own
+        # lengths, with some slack as 32 bit floats don't add up to whole seconds
+        while rewound < seconds - 0.0005:
+            step = self.history.undo()
+            if step is None:
+                break
+            state = step
+            rewound += _STATE_HEADER.unpack_from(step)[3]
+        if state is None:
+            return
+        self._unpack_state(state)
+        self.hud.set('player', self.points['player'])
+        self.hud.set('enemy', self.points['enemy'])
+        # the pending serves belong to the future that was just undone
+        self.updateables = [up for up in self.updateables if not isinstance(up, Timer) or not up.once]
+        for ball in self.balls:
+            if ball.direction == DIRECTION['NONE']:
+                self._serve_later(ball)
+        self.drawer()
+        self.display.present()
+        self.dirty_rects.clear()
 
     def update(self, dt):
-        self.dirty_rects += [
-            r.copy()
-            for r in (
-                self.player.rect,
-                self.enemy.rect,
-                self.ball.rect
-            )
-        ]
+        # the state before every step is kept, so rewinding any number of steps
+        # only has to restore a single one
+        self.history.push(self._pack_state(dt))
+        self._snapshot(self._before)
+        self._step(dt)
+        self._snapshot(self._after)
+        self.dirty_rects += self._before
+        self.dirty_rects += self._after
+
+    def _step(self, dt):
         for up in self.updateables:
             up.update(dt)
         self.check_for_points()
-        self.dirty_rects += [
-            self.player.rect,
-            self.enemy.rect,
-            self.ball.rect
-        ]
 
     def check_for_points(self):
-        if self.ball.x <= 0:
-            self.points['player'] += 1
-            self.reset_ball()
-        elif self.ball.x >= self.SCREEN_WIDTH:
-            self.points['enemy'] += 1
-            self.reset_ball()
-
-    def reset_ball(self):
-        self.ball.jump_to(Vector2(self.SCREEN_WIDTH // 2, self.SCREEN_HEIGHT // 2))
-        self.ball.direction = DIRECTION['NONE']
+        for ball in self.balls:
+            if ball.x <= 0:
+                self.points['player'] += 1
+                self.hud.set('player', self.points['player'])
+                self.reset_ball(ball)
+            elif ball.x >= self.SCREEN_WIDTH:
+                self.points['enemy'] += 1
+                self.hud.set('enemy', self.points['enemy'])
+                self.reset_ball(ball)
+
+    def reset_ball(self, ball=None):
+        ball = ball or self.ball
+        ball.jump_to(Vector2(self.SCREEN_WIDTH // 2, self.SCREEN_HEIGHT // 2))
+        ball.direction = DIRECTION['NONE']
+        self._serve_later(ball)
+
+    def _serve_later(self, ball):
+        self.updateables = [
+            up for up in self.updateables
+            if not isinstance(up, Timer) or up.alive
+        ]
         self.updateables.append(
-            Timer(1.5, lambda: setattr(self.ball, 'direction', DIRECTION['LEFT_UP']), once=True)
+            Timer(1.5, lambda: setattr(ball, 'direction', DIRECTION['LEFT_UP']), once=True)
         )
 
-    def randomize_ball(self):
+    def randomize_balls(self):
         pi4 = math.pi / 4
-        self.ball.direction = (
-            self.ball.direction + Vector2(
-                random.uniform(-pi4, pi4),
-                random.uniform(-pi4, pi4)
-            )
-        ).normalize()
-        self.ball.change_speed(random.randrange(20))
+        for ball in self.balls:
+            if ball.direction == DIRECTION['NONE']:
+                continue
+            ball.direction = (
+                ball.direction + Vector2(
+                    random.uniform(-pi4, pi4),
+                    random.uniform(-pi4, pi4)
+                )
+            ).normalize()
+            ball.change_speed(random.randrange(20))
+
+
+class MultiBallPongGame(PongGame):
+    """
+    Pong with many balls at once, which also bounce off each other.
+    Pairs of balls that may collide are looked up in a uniform grid that
+    is rebuilt once per frame, so every ball only checks its own
+    neighbourhood instead of every other ball. The paddles stay out of
+    the grid: they only move up and down at the sides, so only balls that
+    reach past the lane between them look at the paddles at all.
+    """
+
+    def __init__(self, ball_count=50, cell_size=32, **display_options):
+        super().__init__(**display_options)
+        self.grid = SpatialHash(cell_size)
+        lane = self.player.rect.right, self.enemy.rect.left
+        self.ball.free_lane = lane
+        for _ in range(ball_count - 1):
+            self.balls.append(Ball(
+                Vector2(
+                    random.uniform(self.SCREEN_WIDTH / 4, self.SCREEN_WIDTH * 3 / 4),
+                    random.uniform(self.SCREEN_HEIGHT / 4, self.SCREEN_HEIGHT * 3 / 4)
+                ),
+                radius=self.ball.radius,
+                speed=random.uniform(300, 600),
+                direction=Vector2(
+                    random.choice((-1, 1)) * random.uniform(0.5, 1),
+                    random.uniform(-1, 1)
+                ).normalize(),
+                min_y=0,
+                max_y=self.SCREEN_HEIGHT,
+                colliders=[self.player, self.enemy],
+                free_lane=lane
+            ))
+        self.updateables = [
+            self.player,
+            self.enemy,
+            Timer(5, self.randomize_balls)
+        ]
+        self._track_movers()
+
+    def _rebuild_grid(self):
+        """
+        Inserts the balls into the grid where they ended up this frame.
+        """
+        grid = self.grid
+        grid.clear()
+        for ball in self.balls:
+            grid.insert(ball)
+
+    def _track_ball(self):
+        """
+        Lets the AI follow the ball that will reach its side first.
+        """
+        best, best_eta = self.ball, math.inf
+        for ball in self.balls:
+            vx = ball.speed * ball.dir_x()
+            if vx > 0:
+                eta = (self.enemy.x - ball.x) / vx
+                if 0 <= eta < best_eta:
+                    best, best_eta = ball, eta
+        self.enemy.ball = best
+
+    def _step(self, dt):
+        self._track_ball()
+        for up in self.updateables:
+            up.update(dt)
+        for ball in self.balls:
+            ball.update(dt)
+        self._rebuild_grid()
+        for a, b in self.grid.pairs():
+            a.collide_ball(b)
+        self.check_for_points()
 
 
 if __name__ == '__main__':
     pg.init()
     pg.mouse.set_visible(False)
-    PongGame().game_loop()
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    options = {'adaptive_quality': '--fixed-quality' not in sys.argv}
+    game = MultiBallPongGame(int(args[0]), **options) if args else PongGame(**options)
+    if '--alloc-stats' in sys.argv:
+        game.allocation_stats = AllocationStats()
+    if game.governor is not None and '--log-quality' in sys.argv:
+        game.governor.on_change = print
+    game.profiler.install_signal()
+    game.game_loop()
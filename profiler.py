@@ -0,0 +1,132 @@
+import os
+import sys
+import time
+import signal
+import threading
+from collections import Counter
+
+
+class SamplingProfiler:
+    """
+    Samples the stack of the game's thread from a background thread
+    while a capture is running, so a slow game can be profiled without
+    restarting it.
+
+    The game loop names the phase it is in by setting `phase`, every
+    sample is filed under the phase current at that moment. Stopping a
+    capture writes the samples as collapsed stacks (one
+    `phase;outer;...;inner count` line per distinct stack), the format
+    read by flamegraph.pl, speedscope and similar tools.
+
+    While no capture is running, the only cost is setting `phase`.
+    """
+
+    def __init__(self, interval=0.005, directory='.'):
+        """
+        :param interval: {float} seconds between two samples
+        :param directory: {str} where the capture files are written
+        """
+        self.interval = interval
+        self.directory = directory
+        self.phase = 'other'
+        self.samples = Counter()
+        self.captures = 0
+        self._target = None
+        self._thread = None
+        self._stopping = threading.Event()
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        """
+        Starts a capture of the main thread, unless one is already running.
+
+        :return: {None}
+        """
+        if self.running:
+            return
+        self.samples.clear()
+        self.captures += 1
+        self._target = threading.main_thread().ident
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._sample, name='profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Ends the capture and writes its samples.
+
+        :return: {str} path of the written file, None if no capture was running
+        """
+        if not self.running:
+            return None
+        self._stopping.set()
+        self._thread.join()
+        self._thread = None
+        path = self.write()
+        print('profile written to', path)
+        return path
+
+    def toggle(self):
+        """
+        Starts a capture or stops the running one.
+
+        :return: {str} path of the written file if a capture was stopped, else None
+        """
+        if self.running:
+            return self.stop()
+        self.start()
+        print('profiling')
+        return None
+
+    def install_signal(self, signum=getattr(signal, 'SIGUSR1', None)):
+        """
+        Makes `signum` toggle the capture, e.g. `kill -USR1 <pid>`.
+        Has to be called from the main thread.
+
+        :param signum: {int} signal number, defaults to SIGUSR1 where it exists
+        :return: {None}
+        """
+        if signum is not None:
+            signal.signal(signum, lambda signum, frame: self.toggle())
+
+    def _sample(self):
+        # the stacks are kept as tuples of code objects and only turned into
+        # text when writing, so taking a sample is cheap
+        samples, target, interval = self.samples, self._target, self.interval
+        while not self._stopping.wait(interval):
+            frame = sys._current_frames().get(target)
+            stack = []
+            while frame is not None:
+                stack.append(frame.f_code)
+                frame = frame.f_back
+            if stack:
+                samples[self.phase, tuple(stack)] += 1
+
+    @staticmethod
+    def _name(code):
+        return '{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+    def write(self, path=None):
+        """
+        Writes the samples of the last capture as collapsed stacks.
+
+        :param path: {str} file to write, defaults to a new time stamped file in `directory`
+        :return: {str} path of the written file
+        """
+        if path is None:
+            name = time.strftime('profile-%Y%m%d-%H%M%S') + '-{}-{}.folded'.format(os.getpid(), self.captures)
+            path = os.path.join(self.directory, name)
+        names = {}
+        with open(path, 'w') as file:
+            for (phase, stack), count in self.samples.items():
+                frames = [phase]
+                for code in reversed(stack):
+                    name = names.get(code)
+                    if name is None:
+                        name = names[code] = self._name(code)
+                    frames.append(name)
+                file.write('{} {}\n'.format(';'.join(frames), count))
+        return path
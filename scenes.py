@@ -0,0 +1,130 @@
+import pygame as pg
+from buttons import EventType
+
+
+class Scene:
+    """
+    Declares one state a game can be in, like playing, paused or game
+    over: which of the game's methods the keys and buttons call, and
+    whether the game keeps running. Scenes only hold names, so they can
+    be declared once on the game class and shared by all its instances.
+    """
+
+    def __init__(self, keys=None, key_releases=None, buttons=None, button_releases=None, button_chords=None,
+                 active=True):
+        """
+        :param keys: {dict<int, str>} pygame keys mapped to the names of the game methods called on key down
+        :param key_releases: {dict<int, str>} like `keys`, but called on key up
+        :param buttons: {dict<int, str>} GPIO buttons mapped to the names of the game methods called on press
+        :param button_releases: {dict<int, str>} like `buttons`, but called on release
+        :param button_chords: {dict<tuple<int>, str>} (held, pressed) button pairs mapped to the names of the
+                              game methods called when `pressed` goes down while `held` is down, instead of
+                              the method bound to `pressed` alone
+        :param active: {bool} whether the game is updated and drawn, an inactive game can sleep until input arrives
+        """
+        self.keys = keys or {}
+        self.key_releases = key_releases or {}
+        self.buttons = buttons or {}
+        self.button_releases = button_releases or {}
+        self.button_chords = button_chords or {}
+        self.active = active
+
+
+class SceneMachine:
+    """
+    Switches a game between its scenes and passes input to the methods
+    bound in the current one.
+
+    Every scene is compiled once into a table of bound methods keyed by
+    event type and then by key or button, so handling an event takes two
+    dict lookups no matter how many bindings there are, and methods that
+    don't apply in a scene are simply not bound in it.
+    """
+
+    def __init__(self, game, scenes, initial):
+        """
+        :param game: {object} object the method names are looked up on
+        :param scenes: {dict<str, Scene>} scenes by name
+        :param initial: {str} name of the scene to start in
+        """
+        self.scenes = scenes
+        self._tables = {name: self._compile(game, scene) for name, scene in scenes.items()}
+        self._chord_tables = {name: self._compile_chords(game, scene) for name, scene in scenes.items()}
+        self.held_buttons = set()
+        self.switch(initial)
+
+    @staticmethod
+    def _compile(game, scene):
+        def bind(bindings):
+            return {key: getattr(game, action) for key, action in bindings.items()}
+
+        return {
+            pg.KEYDOWN: bind(scene.keys),
+            pg.KEYUP: bind(scene.key_releases),
+            EventType.BUTTON_DOWN: bind(scene.buttons),
+            EventType.BUTTON_UP: bind(scene.button_releases)
+        }
+
+    @staticmethod
+    def _compile_chords(game, scene):
+        chords = {}
+        for (held, pressed), action in scene.button_chords.items():
+            chords.setdefault(pressed, []).append((held, getattr(game, action)))
+        return chords
+
+    def switch(self, name):
+        """
+        Makes `name` the current scene. Input handled after this call
+        uses its bindings, even within the same batch of events.
+
+        :param name: {str} name of the scene
+        :return: {None}
+        """
+        self.current = name
+        self.active = self.scenes[name].active
+        self._table = self._tables[name]
+        self._chords = self._chord_tables[name]
+
+    def handle_events(self, events):
+        """
+        Calls the methods bound to the key presses and releases in `events`.
+
+        :param events: {iterable<pygame.event.Event>} events to handle
+        :return: {int} number of methods called
+        """
+        handled = 0
+        for ev in events:
+            handlers = self._table.get(ev.type)
+            if handlers:
+                handler = handlers.get(ev.key)
+                if handler is not None:
+                    handler()
+                    handled += 1
+        return handled
+
+    def handle_buttons(self, presses):
+        """
+        Calls the methods bound to the button events in `presses`, keeping
+        track of the buttons held down for the chords.
+
+        :param presses: {iterable<buttons._ButtonEvent>} button events to handle
+        :return: {int} number of methods called
+        """
+        handled = 0
+        held_buttons = self.held_buttons
+        for bp in presses:
+            handler = None
+            if bp.type is EventType.BUTTON_DOWN:
+                for held, chord_handler in self._chords.get(bp.button, ()):
+                    if held in held_buttons:
+                        handler = chord_handler
+                        break
+                held_buttons.add(bp.button)
+            else:
+                held_buttons.discard(bp.button)
+            if handler is None:
+                handler = self._table[bp.type].get(bp.button)
+            if handler is not None:
+                handler()
+                handled += 1
+        return handled
@@ -1,14 +1,23 @@
+import sys
 import random
+import struct
 import itertools
 from functools import partialmethod
 from collections import deque
 import pygame as pg
-#from buttons import *
-from utils import DIRECTION, Vector2, Timer
+from buttons import CROSS_UP, CROSS_LEFT, CROSS_RIGHT, CROSS_DOWN, EXTRA_A, EXTRA_B, get_button_presses
+from utils import DIRECTION, Vector2, Timer, Display, AllocationStats, wait_for_events
+from hud import Hud
+from scenes import Scene, SceneMachine
+from profiler import SamplingProfiler
+from history import DeltaHistory
+from governor import QualityLevel, FrameGovernor
 
 
 class Snake:
 
+    __slots__ = ('edges', 'direction', 'parts', 'growth_per_food', 'growth_left', 'alive')
+
     def __init__(self, start_pos, edges, growth_per_food):
         self.edges = edges
         self.direction = DIRECTION['UP']
@@ -20,8 +29,10 @@ class Snake:
     def move(self):
         if not self.alive:
             return
-        new_head = (self.head + self.direction) % self.edges
-        if new_head in self.body:
+        head, direction, edges = self.parts[0], self.direction, self.edges
+        new_head = Vector2((head[0] + direction[0]) % edges[0], (head[1] + direction[1]) % edges[1])
+        # the new head is never the old one, so checking all parts is the same as checking the body
+        if new_head in self.parts:
             self.alive = False
         else:
             self.add_head(new_head)
@@ -65,36 +76,450 @@ class Snake:
             yield part
 
 
+def hamiltonian_cycle(width, height):
+    """
+    Builds a cycle that visits every cell of the (wrapping) board
+    exactly once. Row 0 is walked from left to right, the remaining rows
+    snake back and forth between columns 1 and `width - 1`, and column 0
+    leads back up to the start. If `height` is odd, the last row is
+    spliced in between (0, 0) and (1, 0) using the wrap-around edges.
+
+    :param width: {int} columns of the board, at least 2
+    :param height: {int} rows of the board, at least 2
+    :return: {list<tuple<int>>} x, y pairs in cycle order
+    """
+    if width < 2 or height < 2:
+        raise ValueError('board must be at least 2x2')
+    rows = height - height % 2
+    cycle = [(0, 0)]
+    if height % 2:
+        last = height - 1
+        cycle += [(0, last)] + [(x, last) for x in range(width - 1, 0, -1)]
+    cycle += [(x, 0) for x in range(1, width)]
+    for y in range(1, rows):
+        columns = range(width - 1, 0, -1) if y % 2 else range(1, width)
+        cycle += [(x, y) for x in columns]
+    cycle += [(0, y) for y in range(rows - 1, 0, -1)]
+    return cycle
+
+
+class SnakeAutopilot:
+    """
+    Steers a snake towards the food on its own, without ever running
+    into itself.
+
+    The snake moves along a Hamiltonian cycle through the (wrapping)
+    board, kept as the cell before and after every cell and the position
+    of every cell along it. Positions are spread out, so cells moved to
+    another part of the cycle fit in between without renumbering the
+    rest. While the whole body lies along the cycle, the cells from the
+    head forward to the tail are exactly the free ones. So the next cell
+    of the cycle is free until the board is full, however much the snake
+    grows.
+
+    Shortcuts keep it that way. To step from the head to a free
+    neighbour further along the cycle, the cells in between are cut out
+    as a cycle of their own, which needs their first and last cell to be
+    neighbours. That cycle is joined into the free part again behind the
+    food, where one of its edges runs alongside one there, so the skipped
+    cells stay ahead of the head and the food gets closer by all of
+    them. If there's no such place, more than `SHORTCUT_LIMIT` cells
+    would be cut out or more than `RELABEL_LIMIT` would need new
+    positions, the snake follows the cycle. Either way every move
+    brings the food closer along the cycle.
+
+    Which neighbour to try first comes from a breadth first search from
+    the food over the free cells. It keeps its state from move to move
+    and expands at most `SEARCH_BUDGET` cells per move, until it reaches
+    a neighbour of the head. Until then the neighbours furthest along the
+    cycle are tried first.
+
+    The board is kept as flat lists indexed by `y * width + x`. Every
+    occupied cell stores the serial number the snake's head had when it
+    entered that cell. These lists are updated by `sync` only for the
+    cells the head and tail just changed, and all search buffers are
+    allocated once and reused with a generation stamp.
+
+    A rewind can leave the body off the cycle. Until it lies along the
+    cycle again, the snake follows the cycle where it can and any cell
+    that is free by then where it can't, with no guarantee.
+    """
+
+    # cells the search may expand per move
+    SEARCH_BUDGET = 1000
+    # most cells a shortcut may cut out of the cycle
+    SHORTCUT_LIMIT = 1000
+    # most cells a shortcut may give new positions
+    RELABEL_LIMIT = 2000
+    # distance between the positions of neighbouring cells along a freshly laid cycle
+    ORDER_GAP = 1 << 40
+
+    def __init__(self, snake, width, height):
+        self.snake = snake
+        self.width = width
+        self.height = height
+        size = width * height
+        self.neighbors = [
+            (
+                y * width + (x + 1) % width,
+                y * width + (x - 1) % width,
+                ((y + 1) % height) * width + x,
+                ((y - 1) % height) * width + x
+            )
+            for y in range(height)
+            for x in range(width)
+        ]
+        self._cycle = hamiltonian_cycle(width, height)
+        self.cycle_next = [0] * size
+        self.cycle_prev = [0] * size
+        self.cycle_order = [0] * size
+        self._order_span = size * self.ORDER_GAP
+
+        self.serial = [-1] * size
+        self._seen = [0] * size
+        self._depth = [0] * size
+        self._stamp = 0
+        self._queue = deque()
+        self._skipped = []
+        self.target = None
+        self._lay_cycle(self._index(snake.parts[0]))
+        self.reset()
+
+    def _index(self, pos):
+        return int(pos[1]) % self.height * self.width + int(pos[0]) % self.width
+
+    def _lay_cycle(self, head):
+        """
+        Lays the cycle of `hamiltonian_cycle` over the board so that it
+        runs up column 0 into (0, 0) at `head`, which covers a new
+        snake: straight and heading up.
+        """
+        width, height = self.width, self.height
+        hx, hy = head % width, head // width
+        cells = [(y + hy) % height * width + (x + hx) % width for x, y in self._cycle]
+        for order, (cell, nxt) in enumerate(zip(cells, cells[1:] + cells[:1])):
+            self.cycle_next[cell] = nxt
+            self.cycle_prev[nxt] = cell
+            self.cycle_order[cell] = order * self.ORDER_GAP
+
+    def _renumber(self):
+        """
+        Spreads the positions along the cycle out evenly again, starting at the head.
+        """
+        cycle_next, order, gap = self.cycle_next, self.cycle_order, self.ORDER_GAP
+        cell = self._head
+        for position in range(0, self._order_span, gap):
+            order[cell] = position
+            cell = cycle_next[cell]
+
+    def _count_along(self):
+        """
+        :return: {int} body parts behind the head that follow each other along the cycle
+        """
+        cycle_next, index = self.cycle_next, self._index
+        along = 0
+        cell = index(self.snake.parts[0])
+        for part in itertools.islice(self.snake.parts, 1, None):
+            part = index(part)
+            if cycle_next[part] != cell:
+                break
+            along += 1
+            cell = part
+        return along
+
+    def reset(self):
+        """
+        Rebuilds the board from scratch out of `snake.parts`. If the body
+        doesn't lie along the cycle, the cycle is laid out anew.
+
+        :return: {None}
+        """
+        serial = self.serial
+        for i in range(len(serial)):
+            serial[i] = -1
+        parts = self.snake.parts
+        self.head_serial = len(parts) - 1
+        self.tail_serial = 0
+        for j, part in enumerate(parts):
+            serial[self._index(part)] = self.head_serial - j
+        self._head = self._index(parts[0])
+        self._tail = self._index(parts[-1])
+        self._length = len(parts)
+        self._along = self._count_along()
+        if self._along < self._length - 1:
+            self._lay_cycle(self._head)
+            self._along = self._count_along()
+        self.target = None
+
+    def sync(self):
+        """
+        Applies the snake's last move to the board. Only the new head
+        and the removed tail cell are touched.
+
+        :return: {None}
+        """
+        parts = self.snake.parts
+        head = self._index(parts[0])
+        if head == self._head:
+            return
+        grown = len(parts) - self._length
+        if grown not in (0, 1) or head not in self.neighbors[self._head]:
+            self.reset()
+            return
+        self._along = self._along + 1 if head == self.cycle_next[self._head] else 0
+        self.head_serial += 1
+        self.serial[head] = self.head_serial
+        self._head = head
+        if not grown:
+            self.serial[self._tail] = -1
+            self.tail_serial += 1
+            self._tail = self._index(parts[-1])
+        self._length = len(parts)
+
+    def _enterable(self, cell, step):
+        """
+        Checks if the head may enter `cell` with its `step`th move from
+        now, i.e. if the body part there will be gone by then.
+        """
+        serial = self.serial[cell]
+        return serial < 0 or serial - self.tail_serial < step - 1 - self.snake.growth_left
+
+    def _ahead(self, cell):
+        """
+        How far `cell` is from the head, following the cycle forwards.
+        Positions are spread out, so this is only good for comparisons.
+        """
+        return (self.cycle_order[cell] - self.cycle_order[self._head]) % self._order_span
+
+    def _search(self):
+        """
+        Continues the breadth first search from the food over the free
+        cells, for at most `SEARCH_BUDGET` cells or until it reaches a
+        neighbour of the head.
+        """
+        stamp = self._stamp
+        seen, depth, queue = self._seen, self._depth, self._queue
+        neighbors, serial = self.neighbors, self.serial
+        around_head = neighbors[self._head]
+        for _ in range(self.SEARCH_BUDGET):
+            if not queue:
+                return
+            cell = queue.popleft()
+            step = depth[cell] + 1
+            reached = False
+            for nxt in neighbors[cell]:
+                if seen[nxt] == stamp or serial[nxt] >= 0:
+                    continue
+                seen[nxt] = stamp
+                depth[nxt] = step
+                queue.append(nxt)
+                reached = reached or nxt in around_head
+            if reached:
+                return
+
+    def _candidates(self, target):
+        """
+        :param target: {int} cell of the food
+        :return: {list<int>} free neighbours of the head up to the food along the cycle,
+                 the ones the search found closest to the food first, then the ones furthest along
+        """
+        stamp, seen, depth, serial = self._stamp, self._seen, self._depth, self.serial
+        limit = self._ahead(target)
+        cells = [cell for cell in self.neighbors[self._head] if serial[cell] < 0 and self._ahead(cell) <= limit]
+        if not any(seen[cell] == stamp for cell in cells):
+            self._search()
+        cells.sort(key=lambda cell: (depth[cell] if seen[cell] == stamp else len(seen), -self._ahead(cell)))
+        return cells
+
+    def _shortcut(self, cell, target):
+        """
+        Changes the cycle so that `cell`, a free neighbour of the head no
+        further along than the food, comes right after the head, and the
+        cells skipped are joined into the cycle again behind the food.
+
+        :param cell: {int} free neighbour of the head
+        :param target: {int} cell of the food
+        :return: {bool} whether the cycle was changed
+        """
+        cycle_next, cycle_prev, neighbors, serial = self.cycle_next, self.cycle_prev, self.neighbors, self.serial
+        head = self._head
+        first = cycle_next[head]
+        if cycle_prev[cell] not in neighbors[first]:
+            return False
+        skipped = self._skipped
+        skipped.clear()
+        nxt = first
+        while nxt != cell:
+            if len(skipped) == self.SHORTCUT_LIMIT:
+                return False
+            skipped.append(nxt)
+            nxt = cycle_next[nxt]
+        count = len(skipped)
+        last = skipped[-1]
+        order, span = self.cycle_order, self._order_span
+        origin = order[head]
+        behind_food = self._ahead(target)
+        tail_ahead = self._ahead(self._tail)
+
+        # an edge x -> y of the cut out cycle next to an edge u -> v behind the food
+        for i in range(count):
+            x, y = skipped[i], skipped[(i + 1) % count]
+            for u in neighbors[x] + neighbors[y]:
+                if serial[u] >= 0 or not behind_food <= (order[u] - origin) % span < tail_ahead:
+                    continue
+                v = cycle_next[u]
+                forwards = u in neighbors[y] and v in neighbors[x]
+                if forwards or u in neighbors[x] and v in neighbors[y]:
+                    break
+            else:
+                continue
+            break
+        else:
+            return False
+        room = self._room(u, v, count, cell)
+        if room is None:
+            return False
+
+        if forwards:
+            # u -> y ... x -> v, the cut out cycle keeps its direction
+            cycle_next[last] = first
+            cycle_prev[first] = last
+            cycle_next[u], cycle_prev[y] = y, u
+            cycle_next[x], cycle_prev[v] = v, x
+        else:
+            # u -> x ... y -> v, the cut out cycle runs backwards
+            for j in range(count):
+                cycle_next[skipped[j]] = skipped[j - 1]
+                cycle_prev[skipped[j - 1]] = skipped[j]
+            cycle_next[u], cycle_prev[x] = x, u
+            cycle_next[y], cycle_prev[v] = v, y
+        cycle_next[head] = cell
+        cycle_prev[cell] = head
+        self._place(*room)
+        return True
+
+    def _room(self, start, end, count, cell):
+        """
+        Finds the stretch of the cycle to give new positions when `count`
+        cells are put in between `start` and `end` by a shortcut to
+        `cell`. Where the positions around are too close, it takes in the
+        neighbouring cells as well, but never the cells cut out.
+
+        :return: {tuple} the cells before and after the stretch and how many get new positions,
+                 None if those would be more than `RELABEL_LIMIT`
+        """
+        cycle_next, cycle_prev = self.cycle_next, self.cycle_prev
+        order, span = self.cycle_order, self._order_span
+        while (order[end] - order[start]) % span // (count + 1) < self.ORDER_GAP >> 20:
+            if start == cell or end == self._head:
+                # renumbering a board this small is no more work than the limit allows
+                return (None, None, count) if len(order) <= self.RELABEL_LIMIT else None
+            if count >= self.RELABEL_LIMIT:
+                return None
+            start, end = cycle_prev[start], cycle_next[end]
+            count += 2
+        return start, end, count
+
+    def _place(self, start, end, count):
+        """
+        Spreads the positions of the cells between `start` and `end` out
+        evenly in between theirs, a stretch found by `_room` before the
+        cycle was changed.
+        """
+        if start is None:
+            self._renumber()
+            return
+        cycle_next, order, span = self.cycle_next, self.cycle_order, self._order_span
+        step = (order[end] - order[start]) % span // (count + 1)
+        position = order[start]
+        cell = cycle_next[start]
+        while cell != end:
+            position += step
+            order[cell] = position % span
+            cell = cycle_next[cell]
+
+    def _direction(self, cell):
+        hx, hy = self._head % self.width, self._head // self.width
+        x, y = cell % self.width, cell // self.width
+        if y == hy:
+            return DIRECTION['RIGHT'] if x == (hx + 1) % self.width else DIRECTION['LEFT']
+        return DIRECTION['DOWN'] if y == (hy + 1) % self.height else DIRECTION['UP']
+
+    def steer(self, food_pos):
+        """
+        Points the snake at the next cell of its route. Has to be called
+        right before every `Snake.move`, followed by `sync`.
+
+        :param food_pos: {Vector} position of the food
+        :return: {None}
+        """
+        if not self.snake.alive:
+            return
+        target = self._index(food_pos)
+        if target != self.target:
+            self.target = target
+            self._stamp += 1
+            self._seen[target] = self._stamp
+            self._depth[target] = 0
+            self._queue.clear()
+            self._queue.append(target)
+        head = self._head
+        nxt = self.cycle_next[head]
+        if self._along < self._length - 1:
+            # the body is off the cycle after a rewind
+            for cell in (nxt,) + self.neighbors[head]:
+                if self._enterable(cell, 1):
+                    self.snake.change_direction(self._direction(cell))
+                    return
+            return
+        for cell in self._candidates(target):
+            if cell == nxt or self._shortcut(cell, target):
+                nxt = cell
+                break
+        self.snake.change_direction(self._direction(nxt))
+
+
 class SnakeDrawer:
 
     def __init__(self, bg_color, snake_color, food_color, game):
         self.bg_color = bg_color
         self.snake_color = snake_color
         self.food_color = food_color
+        self.outline_color = pg.Color('black')
         self.game = game
         self.screen = game.screen
+        self.display = game.display
+        self.outlines = True
+        self._block = pg.Rect(0, 0, game.block_size, game.block_size)
+        self._scaled = self._block.copy()
 
     def __call__(self):
         self.draw()
 
     def block(self, pos):
-        return pg.Rect(
-            pos * self.game.block_size,
-            (self.game.block_size, self.game.block_size)
-        )
+        """
+        The screen area of the block at `pos`. The same rect is updated
+        and returned on every call.
+        """
+        block = self._block
+        block.x = pos[0] * self.game.block_size
+        block.y = pos[1] * self.game.block_size
+        return self.display.rect(block, self._scaled)
 
     def draw_part(self, part):
+        block = self.block(part)
         pg.draw.rect(
             self.screen,
             self.snake_color,
-            self.block(part)
-        )
-        pg.draw.rect(
-            self.screen,
-            pg.Color('black'),
-            self.block(part),
-            1
+            block
         )
+        if self.outlines:
+            pg.draw.rect(
+                self.screen,
+                self.outline_color,
+                block,
+                1
+            )
 
     def draw_food(self, pos):
         pg.draw.rect(
@@ -107,16 +532,72 @@ class SnakeDrawer:
         self.screen.fill(self.bg_color)
         for part in self.game.snake.parts:
             self.draw_part(part)
-        self.draw_food(self.game.food_pos)
+        if self.game.food_pos is not None:
+            self.draw_food(self.game.food_pos)
+        self.game.hud.draw(self.screen)
+
+
+# one snake move: the added head and the removed tail (-1 if there is none), then
+# direction, growth left, alive, food position (-1 once the board is full) and score,
+# each before and after
+_MOVE = struct.Struct('<4h4b2i2?4h2i')
 
 
 class SnakeGame:
 
     FPS = 60
     SCREEN_SIZE = Vector2(1600, 900)
-
-    def __init__(self, block_size, snake_blocks_per_second):
-        self.screen = pg.display.set_mode(self.SCREEN_SIZE, pg.FULLSCREEN)
+    REWIND_BUDGET = 16 * 1024
+    # what the governor may step through when frames take too long, from best to cheapest
+    QUALITY_LEVELS = (
+        QualityLevel(fps=60, outlines=True, render_scale=1),
+        QualityLevel(fps=60, outlines=False, render_scale=1),
+        QualityLevel(fps=45, outlines=False, render_scale=1),
+        QualityLevel(fps=45, outlines=False, render_scale=0.75),
+        QualityLevel(fps=30, outlines=False, render_scale=0.5)
+    )
+    SCENES = {
+        'playing': Scene(
+            keys={
+                pg.K_ESCAPE: 'quit',
+                pg.K_F12: 'toggle_profiler',
+                pg.K_p: 'pause',
+                pg.K_BACKSPACE: 'rewind',
+                pg.K_w: 'look_up',
+                pg.K_a: 'look_left',
+                pg.K_s: 'look_down',
+                pg.K_d: 'look_right'
+            },
+            buttons={
+                CROSS_UP: 'look_up',
+                CROSS_LEFT: 'look_left',
+                CROSS_DOWN: 'look_down',
+                CROSS_RIGHT: 'look_right',
+                EXTRA_A: 'pause'
+            },
+            button_chords={(EXTRA_B, EXTRA_A): 'toggle_profiler'}
+        ),
+        'paused': Scene(
+            keys={pg.K_ESCAPE: 'quit', pg.K_F12: 'toggle_profiler', pg.K_p: 'resume', pg.K_BACKSPACE: 'rewind'},
+            buttons={EXTRA_A: 'resume'},
+            button_chords={(EXTRA_B, EXTRA_A): 'toggle_profiler'},
+            active=False
+        ),
+        'game_over': Scene(
+            keys={pg.K_ESCAPE: 'quit', pg.K_F12: 'toggle_profiler', pg.K_RETURN: 'restart', pg.K_BACKSPACE: 'rewind'},
+            buttons={EXTRA_A: 'restart'},
+            button_chords={(EXTRA_B, EXTRA_A): 'toggle_profiler'},
+            active=False
+        )
+    }
+
+    def __init__(self, block_size, snake_blocks_per_second, autopilot=False,
+                 render_size=None, smooth=False, hardware_scaling=False, idle_wait=True, adaptive_quality=True):
+        self.display = Display(self.SCREEN_SIZE, render_size, smooth, hardware_scaling)
+        self.screen = self.display.surface
+        self.base_render_size = self.display.render_size
+        self.fps = self.FPS
+        self.governor = FrameGovernor(self.QUALITY_LEVELS) if adaptive_quality else None
         self.width, self.height = self.SCREEN_SIZE // block_size
         self.block_size = block_size
         self.drawer = SnakeDrawer(
@@ -125,6 +606,27 @@ class SnakeGame:
             pg.Color('brown3'),
             self
         )
+        self.use_autopilot = autopilot
+        self.snake_move_timer = Timer(
+            interval=1/snake_blocks_per_second,
+            callback=self.move_snake
+        )
+        self.hud = Hud(self.display, 48, pg.Color('floralwhite'), pg.Color('gray45'))
+        self.hud.add('score', (10, 10), label='Score ', digits=4)
+        self.clock = pg.time.Clock()
+        self.idle_wait = idle_wait
+        self._woke_at = 0
+        self.allocation_stats = None
+        self.profiler = SamplingProfiler()
+        self.history = DeltaHistory(self.REWIND_BUDGET)
+        self.running = False
+        self.scenes = SceneMachine(self, self.SCENES, 'playing')
+        self.restart()
+
+    def restart(self):
+        """
+        Starts a new round with a new snake.
+        """
         self.snake = Snake(
             start_pos=Vector2(
                 self.height // 2,
@@ -133,59 +635,236 @@ class SnakeGame:
             edges=Vector2(self.width, self.height),
             growth_per_food=1
         )
-        self.snake_move_timer = Timer(
-            interval=1/snake_blocks_per_second,
-            callback=self.snake.move
-        )
+        self.autopilot = None
+        if self.use_autopilot:
+            self.autopilot = SnakeAutopilot(self.snake, self.width, self.height)
         self.score = 0
+        self.hud.set('score', self.score)
         self.food_pos = self.generate_food()
-        self.clock = pg.time.Clock()
+        self._eat()
+        self.history.clear()
+        self.scenes.switch('playing')
+
+    def _next_events(self):
+        """
+        Waits for the next frame and collects the input. With `idle_wait`,
+        it sleeps until input arrives or the snake is due to move instead,
+        as nothing changes in between. Time spent paused or after the game
+        is over doesn't count.
+
+        :return: {tuple<float, list<pygame.event.Event>>} seconds passed and events
+        """
+        if not self.idle_wait:
+            dt = self.clock.tick(self.fps) / 1000
+            self._govern(self.clock.get_rawtime())
+            return dt, pg.event.get()
+        # the clock's raw time would include the sleep, so the work is timed here
+        work_ms = pg.time.get_ticks() - self._woke_at
+        events = wait_for_events(self.idle_timeout())
+        self._woke_at = pg.time.get_ticks()
+        dt = self.clock.tick() / 1000
+        if self.is_idle():
+            return 0, events
+        self._govern(work_ms)
+        return dt, events
+
+    def _govern(self, frame_ms):
+        if self.governor is not None:
+            level = self.governor.frame(frame_ms)
+            if level is not None:
+                self.apply_quality(level)
+
+    def apply_quality(self, level):
+        """
+        Switches to the frame rate, outlines and internal resolution of `level`.
+
+        :param level: {governor.QualityLevel} level to use
+        :return: {None}
+        """
+        self.fps = level.fps
+        self.drawer.outlines = level.outlines
+        width, height = self.base_render_size
+        if self.display.set_render_size((round(width * level.render_scale), round(height * level.render_scale))):
+            self.screen = self.drawer.screen = self.display.surface
+            self.hud.rebuild()
+
+    def is_idle(self):
+        return not self.scenes.active
+
+    def idle_timeout(self):
+        """
+        :return: {float} seconds until the snake moves, None while it doesn't move at all
+        """
+        if self.is_idle():
+            return None
+        return self.snake_move_timer.time_left()
+
+    def _frame(self, dt):
+        if not self.scenes.active:
+            return
+        profiler = self.profiler
+        profiler.phase = 'update'
+        self.update(dt)
+        profiler.phase = 'draw'
+        self.drawer()
+        profiler.phase = 'present'
+        self.display.present()
+
+    def _start_loop(self):
+        self.running = True
+        # the time spent starting up is neither a frame's work nor a step of the game
+        self._woke_at = pg.time.get_ticks()
+        self.clock.tick()
 
     def game_loop(self):
-        running = True
-        while running:
-            dt = self.clock.tick(self.FPS) / 1000
-            for ev in pg.event.get():
-                if ev.type == pg.KEYDOWN:
-                    if ev.key == pg.K_ESCAPE:
-                        running = False
-                    elif ev.key == pg.K_w:
-                        self.snake.look_up()
-                    elif ev.key == pg.K_a:
-                        self.snake.look_left()
-                    elif ev.key == pg.K_s:
-                        self.snake.look_down()
-                    elif ev.key == pg.K_d:
-                        self.snake.look_right()
-            self.update(dt)
-            self.drawer()
-            pg.display.update()
+        profiler = self.profiler
+        self._start_loop()
+        while self.running:
+            if self.allocation_stats is not None:
+                self.allocation_stats.frame()
+            profiler.phase = 'wait'
+            dt, events = self._next_events()
+            profiler.phase = 'input'
+            self.scenes.handle_events(events)
+            self._frame(dt)
+        profiler.stop()
+        if self.allocation_stats is not None:
+            print(self.allocation_stats.report())
 
     def _game_loop(self):
-        running = True
-        while running:
-            pg.event.pump()
-            dt = self.clock.tick(self.FPS) / 1000
-            for bp in get_button_presses():
-                {
-                    CROSS_UP: self.snake.look_up,
-                    CROSS_DOWN: self.snake.look_down,
-                    CROSS_LEFT: self.snake.look_left,
-                    CROSS_RIGHT: self.snake.look_right
-                }[bp]()
-
-            self.update(dt)
-            self.drawer()
-            pg.display.update()
+        profiler = self.profiler
+        self._start_loop()
+        while self.running:
+            profiler.phase = 'wait'
+            dt, events = self._next_events()
+            profiler.phase = 'input'
+            self.scenes.handle_events(events)
+            self.scenes.handle_buttons(get_button_presses())
+            self._frame(dt)
+        profiler.stop()
+
+    def quit(self):
+        self.running = False
+
+    def toggle_profiler(self):
+        self.profiler.toggle()
 
-    def update(self, dt):
-        self.snake_move_timer.update(dt)
-        if self.snake.is_on_position(self.food_pos):
+    def pause(self):
+        self.scenes.switch('paused')
+
+    def resume(self):
+        self.scenes.switch('playing')
+
+    def steer(self, direction):
+        self.snake.change_direction(direction)
+
+    look_up = partialmethod(steer, DIRECTION['UP'])
+    look_down = partialmethod(steer, DIRECTION['DOWN'])
+    look_left = partialmethod(steer, DIRECTION['LEFT'])
+    look_right = partialmethod(steer, DIRECTION['RIGHT'])
+
+    def move_snake(self):
+        if self.food_pos is None:
+            # the snake fills the board, the round is won
+            return
+        snake = self.snake
+        tail = snake.parts[-1]
+        direction, growth_left, alive = snake.direction, snake.growth_left, snake.alive
+        food_pos, score = self.food_pos, self.score
+        if self.autopilot is None:
+            snake.move()
+        else:
+            self.autopilot.steer(self.food_pos)
+            snake.move()
+            self.autopilot.sync()
+        self._eat()
+
+        moved = alive and snake.alive
+        head = snake.parts[0] if moved else (-1, -1)
+        if not moved or growth_left > 0:
+            tail = (-1, -1)
+        self.history.push(_MOVE.pack(
+            *head, *tail,
+            *direction, *snake.direction,
+            growth_left, snake.growth_left,
+            alive, snake.alive,
+            *food_pos, *(self.food_pos or (-1, -1)),
+            score, self.score
+        ))
+
+    def _eat(self):
+        # new food can show up right under the head, unless it's the only cell left
+        while self.food_pos is not None and self.snake.alive and self.snake.is_on_position(self.food_pos):
             self.snake.grow()
             self.food_pos = self.generate_food()
             self.score += 1
+        self.hud.set('score', self.score)
+
+    def _apply_move(self, move, backward):
+        """
+        Redoes or undoes one move recorded by `move_snake`, touching only
+        the head and tail of the snake.
+        """
+        (head_x, head_y, tail_x, tail_y, dx_before, dy_before, dx_after, dy_after,
+         growth_before, growth_after, alive_before, alive_after,
+         food_x_before, food_y_before, food_x_after, food_y_after,
+         score_before, score_after) = _MOVE.unpack(move)
+        parts = self.snake.parts
+        if backward:
+            if head_x >= 0:
+                parts.popleft()
+            if tail_x >= 0:
+                parts.append(Vector2(tail_x, tail_y))
+            direction, growth_left, alive = Vector2(dx_before, dy_before), growth_before, alive_before
+            food_pos, score = Vector2(food_x_before, food_y_before), score_before
+        else:
+            if head_x >= 0:
+                parts.appendleft(Vector2(head_x, head_y))
+            if tail_x >= 0:
+                parts.pop()
+            direction, growth_left, alive = Vector2(dx_after, dy_after), growth_after, alive_after
+            food_pos, score = Vector2(food_x_after, food_y_after), score_after
+        if food_pos[0] < 0:
+            food_pos = None
+        self.snake.direction = direction
+        self.snake.growth_left = growth_left
+        self.snake.alive = alive
+        self.food_pos = food_pos
+        self.score = score
+
+    def rewind(self, seconds=1):
+        """
+        Takes back the moves of the last `seconds`, as far as the history
+        reaches. A game that is over can be continued from there.
+
+        :param seconds: {float} how far to go back
+        :return: {None}
+        """
+        for _ in range(round(seconds / self.snake_move_timer.interval)):
+            move = self.history.undo()
+            if move is None:
+                break
+            self._apply_move(move, backward=True)
+        self.hud.set('score', self.score)
+        if self.autopilot is not None:
+            self.autopilot.reset()
+        if self.scenes.current == 'game_over' and self.snake.alive and self.food_pos is not None:
+            self.scenes.switch('paused')
+        self.drawer()
+        self.display.present()
+
+    def update(self, dt):
+        self.snake_move_timer.update(dt)
+        if not self.snake.alive or self.food_pos is None:
+            self.scenes.switch('game_over')
 
     def generate_food(self):
+        """
+        :return: {Vector} random cell that isn't covered by the body,
+                 None once the head is the only such cell and the snake has won
+        """
+        if len(self.snake.parts) >= self.width * self.height:
+            return None
         while True:
             pos = Vector2(
                 random.randrange(self.width),
@@ -194,13 +873,16 @@ class SnakeGame:
             if pos not in self.snake.body:
                 return pos
 
-    def pause(self):
-        pass
-
 
 if __name__ == '__main__':
     pg.init()
     pg.mouse.set_visible(False)
-    SnakeGame(100, 6).game_loop()
+    game = SnakeGame(100, 6, autopilot='autopilot' in sys.argv[1:], adaptive_quality='--fixed-quality' not in sys.argv)
+    if '--alloc-stats' in sys.argv:
+        game.allocation_stats = AllocationStats()
+    if game.governor is not None and '--log-quality' in sys.argv:
+        game.governor.on_change = print
+    game.profiler.install_signal()
+    game.game_loop()
 
 
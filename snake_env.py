@@ -0,0 +1,323 @@
+import sys
+import time
+import random
+from collections import deque
+import numpy as np
+from snake import Snake, SnakeAutopilot
+from utils import DIRECTION, Vector2
+
+KEEP, UP, RIGHT, DOWN, LEFT = range(5)
+
+_DX = np.array([0, 0, 1, 0, -1])
+_DY = np.array([0, -1, 0, 1, 0])
+
+
+class BatchedSnakeEnv:
+    """
+    Runs many games of snake at once, one snake move per `step`.
+
+    Every game follows the same rules as `Snake.move`,
+    `Snake.change_direction` and `SnakeGame.update`, but all games are
+    stored in NumPy arrays and stepped with vectorized operations:
+
+    - `occupancy` marks the cells covered by each snake
+    - `body` is a ring buffer of cell indices (`y * width + x`) per game,
+      running from the tail up to `head_ptr`
+    - `direction` holds one of `UP`, `RIGHT`, `DOWN`, `LEFT`
+    - `food`, `growth_left` and `score` as in `SnakeGame`
+
+    Games that end, by running into the body or by filling the board, are
+    reset right away. Every snake starts in the middle of the board,
+    heading up.
+    """
+
+    def __init__(self, games, width, height, growth_per_food=1, seed=None):
+        if height < 3:
+            raise ValueError('board needs at least 3 rows')
+        self.games = games
+        self.width = width
+        self.height = height
+        self.cells = width * height
+        self.growth_per_food = growth_per_food
+        self.rng = np.random.default_rng(seed)
+
+        self.occupancy = np.zeros((games, self.cells), dtype=np.uint8)
+        self.body = np.zeros((games, self.cells + 1), dtype=np.int64)
+        self.head_ptr = np.zeros(games, dtype=np.int64)
+        self.length = np.zeros(games, dtype=np.int64)
+        self.direction = np.zeros(games, dtype=np.int64)
+        self.growth_left = np.zeros(games, dtype=np.int64)
+        self.food = np.zeros(games, dtype=np.int64)
+        self.score = np.zeros(games, dtype=np.int64)
+        self._rows = np.arange(games)
+        self.reset()
+
+    def heads(self, games=None):
+        """
+        :param games: {numpy.ndarray<int>} game indices, defaults to all games
+        :return: {numpy.ndarray<int>} cell index of each head
+        """
+        games = self._rows if games is None else games
+        return self.body[games, self.head_ptr[games]]
+
+    def reset(self, games=None):
+        """
+        Starts the given games over.
+
+        :param games: {numpy.ndarray<int/bool>} game indices or mask, defaults to all games
+        :return: {None}
+        """
+        games = self._rows if games is None else np.asarray(games)
+        if games.dtype == bool:
+            games = np.flatnonzero(games)
+        if not len(games):
+            return
+        x, y = self.width // 2, self.height // 2
+        start = [
+            ((y + 1) % self.height) * self.width + x,
+            y * self.width + x,
+            ((y - 1) % self.height) * self.width + x
+        ]
+        self.occupancy[games] = 0
+        self.occupancy[np.ix_(games, start)] = 1
+        self.body[games, :3] = start
+        self.head_ptr[games] = 2
+        self.length[games] = 3
+        self.direction[games] = UP
+        self.growth_left[games] = 0
+        self.score[games] = 0
+        self._place_food(games)
+
+    def _place_food(self, games):
+        """
+        Picks a random cell outside the body for every game, just like
+        `SnakeGame.generate_food`. Most games succeed after a few random
+        tries, the rest draw from their free cells directly.
+        """
+        for _ in range(8):
+            if not len(games):
+                return
+            candidates = self.rng.integers(self.cells, size=len(games))
+            free = (self.occupancy[games, candidates] == 0) | (candidates == self.heads(games))
+            self.food[games[free]] = candidates[free]
+            games = games[~free]
+        if not len(games):
+            return
+        free = self.occupancy[games] == 0
+        free[np.arange(len(games)), self.heads(games)] = True
+        keys = self.rng.random(free.shape)
+        keys[~free] = -1
+        self.food[games] = keys.argmax(axis=1)
+
+    def step(self, actions):
+        """
+        Turns every snake as requested and moves it one cell.
+
+        :param actions: {numpy.ndarray<int>} one of `KEEP`, `UP`, `RIGHT`, `DOWN`, `LEFT` per game
+        :return: {tuple<numpy.ndarray<bool>>} which games ate food, which were lost and which were won
+        """
+        actions = np.asarray(actions)
+        rows = self._rows
+        ring = self.body.shape[1]
+        width, height = self.width, self.height
+        head = self.body[rows, self.head_ptr]
+        neck = self.body[rows, (self.head_ptr - 1) % ring]
+        hx, hy = head % width, head // width
+
+        turned = ((hy + _DY[actions]) % height) * width + (hx + _DX[actions]) % width
+        turn = (actions != KEEP) & (turned != neck)
+        self.direction[turn] = actions[turn]
+
+        new_head = ((hy + _DY[self.direction]) % height) * width + (hx + _DX[self.direction]) % width
+        died = self.occupancy[rows, new_head] > 0
+        moved = np.flatnonzero(~died)
+        new_head = new_head[moved]
+        self.head_ptr[moved] = (self.head_ptr[moved] + 1) % ring
+        self.body[moved, self.head_ptr[moved]] = new_head
+        self.occupancy[moved, new_head] = 1
+
+        growing = self.growth_left[moved] > 0
+        grown = moved[growing]
+        self.growth_left[grown] -= 1
+        self.length[grown] += 1
+        shrunk = moved[~growing]
+        tail = self.body[shrunk, (self.head_ptr[shrunk] - self.length[shrunk]) % ring]
+        self.occupancy[shrunk, tail] = 0
+
+        ate = np.zeros(self.games, dtype=bool)
+        won = np.zeros(self.games, dtype=bool)
+        eating = moved[new_head == self.food[moved]]
+        while len(eating):
+            ate[eating] = True
+            self.growth_left[eating] += self.growth_per_food
+            self.score[eating] += 1
+            # like `SnakeGame.generate_food`, a snake that covers the board has won
+            full = self.length[eating] >= self.cells
+            won[eating[full]] = True
+            eating = eating[~full]
+            self._place_food(eating)
+            eating = eating[self.food[eating] == self.heads(eating)]
+
+        self.reset(died | won)
+        return ate, died, won
+
+
+def _step_objects(games, width, height, steps, seed):
+    """
+    Steps plain `Snake` objects the way `SnakeGame.update` does, as a
+    baseline for `BatchedSnakeEnv`.
+    """
+    random.seed(seed)
+    edges = Vector2(width, height)
+
+    def new_game():
+        return [Snake(Vector2(width // 2, height // 2), edges, 1), None]
+
+    def generate_food(snake):
+        while True:
+            pos = Vector2(random.randrange(width), random.randrange(height))
+            if pos not in snake.body:
+                return pos
+
+    boards = [new_game() for _ in range(games)]
+    for board in boards:
+        board[1] = generate_food(board[0])
+    turns = [None, Snake.look_up, Snake.look_right, Snake.look_down, Snake.look_left]
+    for _ in range(steps):
+        for board in boards:
+            snake, food = board
+            turn = turns[random.randrange(5)]
+            if turn is not None:
+                turn(snake)
+            snake.move()
+            if not snake.alive:
+                board[:] = new_game()
+                board[1] = generate_food(board[0])
+            elif snake.is_on_position(food):
+                snake.grow()
+                board[1] = generate_food(snake)
+
+
+class _RecordingEnv(BatchedSnakeEnv):
+    """
+    Remembers every food it places, so plain `Snake` objects can be fed
+    the same food.
+    """
+
+    def __init__(self, games, *args, **kwargs):
+        self.placed = [deque() for _ in range(games)]
+        super().__init__(games, *args, **kwargs)
+
+    def _place_food(self, games):
+        super()._place_food(games)
+        for game in games:
+            self.placed[game].append(int(self.food[game]))
+
+
+def check_against_objects(games=50, width=16, height=9, steps=5000, seed=0):
+    """
+    Steps the batched environment and plain `Snake` objects side by side
+    with the same actions and food, and checks after every step that
+    both agree on bodies, directions, growth, scores and which games
+    ended. Every second object is steered by `SnakeAutopilot`, so games
+    are won by filling the board too, the rest turn at random.
+
+    :raise AssertionError: at the first step where they disagree
+    :return: {tuple<int>} games lost and won
+    """
+    rng = random.Random(seed)
+    env = _RecordingEnv(games, width, height, seed=seed)
+    edges = Vector2(width, height)
+    turns = [None, Snake.look_up, Snake.look_right, Snake.look_down, Snake.look_left]
+    codes = {DIRECTION['UP']: UP, DIRECTION['RIGHT']: RIGHT, DIRECTION['DOWN']: DOWN, DIRECTION['LEFT']: LEFT}
+
+    def cell(pos):
+        return int(pos[1]) * width + int(pos[0])
+
+    def position(index):
+        return Vector2(index % width, index // width)
+
+    def new_game(game):
+        snake = Snake(Vector2(width // 2, height // 2), edges, env.growth_per_food)
+        autopilot = SnakeAutopilot(snake, width, height) if game % 2 else None
+        return [snake, autopilot, position(env.placed[game].popleft()), 0]
+
+    boards = [new_game(game) for game in range(games)]
+    lost = won = 0
+    for step in range(steps):
+        actions = np.zeros(games, dtype=np.int64)
+        for game, (snake, autopilot, food, _) in enumerate(boards):
+            if autopilot is None:
+                actions[game] = rng.randrange(5)
+                if actions[game] != KEEP:
+                    turns[actions[game]](snake)
+            else:
+                direction = snake.direction
+                autopilot.steer(food)
+                if snake.direction != direction:
+                    actions[game] = codes[snake.direction]
+        ate, died, finished = env.step(actions)
+
+        for game, board in enumerate(boards):
+            snake, autopilot, food, score = board
+            snake.move()
+            if autopilot is not None:
+                autopilot.sync()
+            context = 'step {}, game {}'.format(step, game)
+            assert died[game] == (not snake.alive), context
+            if not snake.alive:
+                lost += 1
+                board[:] = new_game(game)
+                continue
+            # the same loop as `SnakeGame._eat`, with the food the environment placed
+            eaten = 0
+            while food is not None and snake.is_on_position(food):
+                snake.grow()
+                score += 1
+                eaten += 1
+                food = None if len(snake.parts) >= width * height else position(env.placed[game].popleft())
+            assert ate[game] == (eaten > 0), context
+            assert finished[game] == (food is None), context
+            if food is None:
+                won += 1
+                board[:] = new_game(game)
+                continue
+            board[2:] = food, score
+            assert not env.placed[game], context
+            body = [int(env.body[game, (env.head_ptr[game] - i) % env.body.shape[1]]) for i in range(env.length[game])]
+            assert body == [cell(part) for part in snake.parts], context
+            assert env.direction[game] == codes[snake.direction], context
+            assert env.growth_left[game] == snake.growth_left, context
+            assert env.score[game] == score, context
+            assert env.food[game] == cell(food), context
+    return lost, won
+
+
+def benchmark(width=16, height=9, steps=200, batch_sizes=(1, 64, 1024, 4096)):
+    """
+    Prints how many game steps per second the batched environment and
+    plain `Snake` objects manage, with random actions.
+    """
+    for games in batch_sizes:
+        env = BatchedSnakeEnv(games, width, height, seed=0)
+        actions = env.rng.integers(5, size=(steps, games))
+        start = time.perf_counter()
+        for step_actions in actions:
+            env.step(step_actions)
+        batched = games * steps / (time.perf_counter() - start)
+
+        object_steps = max(1, steps * min(games, 256) // games)
+        start = time.perf_counter()
+        _step_objects(min(games, 256), width, height, object_steps, seed=0)
+        objects = min(games, 256) * object_steps / (time.perf_counter() - start)
+        print('{:>6} games: batched {:>12,.0f} steps/s, objects {:>10,.0f} steps/s, x{:.1f}'.format(
+            games, batched, objects, batched / objects
+        ))
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['check']:
+        lost, won = check_against_objects(*map(int, sys.argv[2:6]))
+        print('batched and object games agree, {} lost and {} won'.format(lost, won))
+    else:
+        benchmark(*map(int, sys.argv[1:3]))
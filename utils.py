@@ -1,10 +1,14 @@
+import gc
 import math
+import time
+import tracemalloc
 import pygame as pg
-from functools import wraps
 
 
 class Timer:
 
+    __slots__ = ('interval', 'callback', 'time', 'once', 'alive')
+
     def __init__(self, interval, callback, once=False):
         self.interval = interval
         self.callback = callback
@@ -30,6 +34,14 @@ class Timer:
             if self.once:
                 self.alive = False
 
+    def time_left(self):
+        """
+        :return: {float} seconds until the callback is due, infinite if the timer is dead
+        """
+        if not self.alive:
+            return math.inf
+        return max(0, self.interval - self.time)
+
 
 def divide_sprite_sheet(sheet, width, height, sprite_width, sprite_height, sprites=None):
     """
@@ -62,27 +74,54 @@ def divide_sprite_sheet(sheet, width, height, sprite_width, sprite_height, sprit
     return images
 
 
-def require_state(state, bool_=True):
+# video drivers SDL can sleep on until an event arrives, on all others
+# `pygame.event.wait` polls every millisecond
+_BLOCKING_DRIVERS = {'x11', 'wayland', 'windows', 'cocoa'}
+# how often to look for events on the other drivers, the rate Minesweeper used to tick at
+POLL_INTERVAL = 0.04
+
+
+def wait_for_events(timeout=None):
     """
-    A decorator of second degree, that calls the decorated method only
-    if the specified attribute of the object, that currently binds the
-    method, has the same value as `_bool`.
+    Sleeps until there is an event to handle or `timeout` seconds have
+    passed, instead of waking up every frame just to poll for input.
+    Where the video driver can't sleep until an event arrives, e.g. on
+    KMSDRM or the dummy driver, it looks for events every `POLL_INTERVAL`.
 
-    :param state: {str} attribute to be checked
-    :param bool_: {bool} boolean value the attribute is checked against
-    :return: {function} decorator
+    :param timeout: {float} seconds to wait at most, None or infinity waits until an event arrives
+    :return: {list<pygame.event.Event>} all pending events
     """
-    def dec(method):
-        @wraps(method)
-        def wrapper(self, *args, **kwargs):
-            if getattr(self, state) == bool_:
-                method(self, *args, **kwargs)
-        return wrapper
-    return dec
+    if timeout == math.inf:
+        timeout = None
+    if pg.display.get_driver() not in _BLOCKING_DRIVERS:
+        return _poll_for_events(timeout)
+    if timeout is None:
+        event = pg.event.wait()
+    else:
+        event = pg.event.wait(max(1, math.ceil(timeout * 1000)))
+    if event.type == pg.NOEVENT:
+        return []
+    return [event] + pg.event.get()
+
+
+def _poll_for_events(timeout):
+    deadline = None if timeout is None else time.perf_counter() + timeout
+    while True:
+        events = pg.event.get()
+        if events:
+            return events
+        sleep = POLL_INTERVAL
+        if deadline is not None:
+            sleep = min(sleep, deadline - time.perf_counter())
+            if sleep <= 0:
+                return []
+        time.sleep(sleep)
 
 
 class Vector(tuple):
 
+    __slots__ = ()
+
     def __add__(self, other):
         return Vector(v + w for v, w in zip(self, other))
 
@@ -155,3 +194,306 @@ DIRECTION = {
     'LEFT_UP': Vector2(-1, -1).normalize(),
     'NONE': Vector2(0, 0)
 }
+
+
+class SpatialHash:
+
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.cells = {}
+        self._used = []
+        self._starts = {}
+        self._found = []
+
+    def clear(self):
+        """
+        Empties every bucket that was used since the last call. The bucket
+        lists themselves are kept, so rebuilding the hash every frame
+        doesn't allocate new lists.
+
+        :return: {None}
+        """
+        cells = self.cells
+        for cell in self._used:
+            cells[cell].clear()
+        self._used.clear()
+        self._starts.clear()
+
+    def _span(self, rect):
+        size = self.cell_size
+        return (
+            range(rect.left // size, (rect.right - 1) // size + 1),
+            range(rect.top // size, (rect.bottom - 1) // size + 1)
+        )
+
+    def insert(self, obj, rect=None):
+        """
+        Puts an object in every cell its rect overlaps. Every object is
+        inserted at most once between two calls of `clear`.
+
+        :param obj: {object} object to be stored, needs a `rect` if no rect is given
+        :param rect: {pygame.Rect} area the object occupies, defaults to `obj.rect`
+        :return: {None}
+        """
+        if rect is None:
+            rect = obj.rect
+        cells = self.cells
+        columns, rows = self._span(rect)
+        self._starts[obj] = columns.start, rows.start
+        for cx in columns:
+            for cy in rows:
+                bucket = cells.get((cx, cy))
+                if bucket is None:
+                    bucket = cells[cx, cy] = []
+                if not bucket:
+                    self._used.append((cx, cy))
+                bucket.append(obj)
+
+    def query(self, rect):
+        """
+        Finds all objects sharing at least one cell with `rect`. These
+        are only candidates, the caller still has to check for an actual
+        collision. The returned list is reused by the next query.
+
+        :param rect: {pygame.Rect} area to search
+        :return: {list<object>} candidates, each contained once
+        """
+        cells = self.cells
+        starts = self._starts
+        found = self._found
+        found.clear()
+        columns, rows = self._span(rect)
+        left, top = columns.start, rows.start
+        for cx in columns:
+            for cy in rows:
+                for obj in cells.get((cx, cy), ()):
+                    # an object spanning several of these cells is only taken from the first one
+                    ox, oy = starts[obj]
+                    if (ox if ox > left else left) == cx and (oy if oy > top else top) == cy:
+                        found.append(obj)
+        return found
+
+    def pairs(self):
+        """
+        Yields every pair of objects sharing a cell, each pair only once.
+
+        :return: {generator<tuple<object>>} candidate pairs
+        """
+        cells = self.cells
+        starts = self._starts
+        for cx, cy in self._used:
+            bucket = cells[cx, cy]
+            count = len(bucket)
+            for i in range(count - 1):
+                a = bucket[i]
+                ax, ay = starts[a]
+                for j in range(i + 1, count):
+                    b = bucket[j]
+                    bx, by = starts[b]
+                    # a pair sharing several cells is only yielded in the first of them
+                    if (ax if ax > bx else bx) == cx and (ay if ay > by else by) == cy:
+                        yield a, b
+
+
+class Display:
+    """
+    The screen the games draw on. Games keep working in logical
+    coordinates (`size`), but may render into a smaller surface of
+    `render_size` that is scaled up to the display in one go when the
+    frame is presented. The drawers map their logical rects and points
+    with `rect`, `point` and `length`.
+    """
+    # above this many dirty rects, `present` scales the whole frame
+    MAX_DIRTY_RECTS = 16
+
+    def __init__(self, size, render_size=None, smooth=False, hardware_scaling=False, flags=pg.FULLSCREEN):
+        """
+        :param size: {tuple<int>} logical screen size
+        :param render_size: {tuple<int>} size of the surface that is drawn to, defaults to `size`
+        :param smooth: {bool} upscale with `smoothscale` instead of nearest neighbour
+        :param hardware_scaling: {bool} let SDL do the upscaling via `pygame.SCALED`
+        :param flags: {int} display flags
+        """
+        self.size = tuple(size)
+        self.smooth = smooth
+        self._set_scale(render_size or size)
+        self.hardware_scaling = hardware_scaling and self.scaled
+        if self.hardware_scaling:
+            try:
+                self.window = pg.display.set_mode(self.render_size, flags | pg.SCALED)
+                self.surface = self.window
+            except pg.error:
+                # no renderer available, scale in software instead
+                self.hardware_scaling = False
+        if not self.hardware_scaling:
+            self.window = pg.display.set_mode(self.size, flags)
+            self.surface = pg.Surface(self.render_size).convert() if self.scaled else self.window
+
+    def _set_scale(self, render_size):
+        self.render_size = tuple(render_size)
+        self.scaled = self.render_size != self.size
+        self.scale_x = self.render_size[0] / self.size[0]
+        self.scale_y = self.render_size[1] / self.size[1]
+
+    def set_render_size(self, render_size):
+        """
+        Switches to another internal resolution while the game is running.
+        This replaces `surface`, so whoever keeps a reference to it has to
+        pick up the new one. With hardware scaling the window would have to
+        be opened again, so the size stays as it is.
+
+        :param render_size: {tuple<int>} new size of the surface that is drawn to
+        :return: {bool} whether the size changed
+        """
+        if self.hardware_scaling or tuple(render_size) == self.render_size:
+            return False
+        self._set_scale(render_size)
+        self.surface = pg.Surface(self.render_size).convert() if self.scaled else self.window
+        return True
+
+    def rect(self, rect, out=None):
+        """
+        Maps a logical rect onto the render surface. Neighbouring rects
+        stay neighbours, so grids don't get gaps.
+
+        :param rect: {pygame.Rect} rect in logical coordinates
+        :param out: {pygame.Rect} rect to store the result in instead of allocating a new one
+        :return: {pygame.Rect} rect in render coordinates
+        """
+        if not self.scaled:
+            return rect
+        left = math.floor(rect[0] * self.scale_x)
+        top = math.floor(rect[1] * self.scale_y)
+        right = math.floor((rect[0] + rect[2]) * self.scale_x)
+        bottom = math.floor((rect[1] + rect[3]) * self.scale_y)
+        if out is None:
+            return pg.Rect(left, top, right - left, bottom - top)
+        out.update(left, top, right - left, bottom - top)
+        return out
+
+    def point(self, pos):
+        if not self.scaled:
+            return pos
+        return math.floor(pos[0] * self.scale_x), math.floor(pos[1] * self.scale_y)
+
+    def length(self, length):
+        if not self.scaled:
+            return length
+        return max(1, round(length * min(self.scale_x, self.scale_y)))
+
+    def _window_rect(self, rect):
+        window_w, window_h = self.window.get_size()
+        up_x = window_w / self.render_size[0]
+        up_y = window_h / self.render_size[1]
+        left = math.floor(rect.left * up_x)
+        top = math.floor(rect.top * up_y)
+        right = math.ceil(rect.right * up_x)
+        bottom = math.ceil(rect.bottom * up_y)
+        return pg.Rect(left, top, right - left, bottom - top)
+
+    def present(self, rects=None):
+        """
+        Brings the rendered frame onto the display. If `rects` are given,
+        only these parts of the screen are scaled and updated. Above
+        `MAX_DIRTY_RECTS` the whole frame is scaled in one go instead.
+
+        :param rects: {list<pygame.Rect>} dirty rects in logical coordinates
+        :return: {None}
+        """
+        if self.hardware_scaling:
+            pg.display.flip()
+            return
+        if not self.scaled:
+            if rects is None:
+                pg.display.update()
+            else:
+                pg.display.update(rects)
+            return
+
+        scale = pg.transform.smoothscale if self.smooth else pg.transform.scale
+        if rects is None:
+            scale(self.surface, self.window.get_size(), self.window)
+            pg.display.update()
+            return
+        if len(rects) > self.MAX_DIRTY_RECTS:
+            # every scaled rect allocates a surface of its own, and many of
+            # them cost more than scaling the whole frame straight into the
+            # window once
+            scale(self.surface, self.window.get_size(), self.window)
+            pg.display.update()
+            return
+        bounds = self.surface.get_rect()
+        updated = []
+        for rect in rects:
+            source = self.rect(rect).inflate(2, 2).clip(bounds)
+            if not source.w or not source.h:
+                continue
+            target = self._window_rect(source)
+            self.window.blit(scale(self.surface.subsurface(source), target.size), target)
+            updated.append(target)
+        pg.display.update(updated)
+
+
+class AllocationStats:
+    """
+    Counts what the game loop allocates per frame, to check that frames
+    in a steady state don't produce garbage that makes the GC pause.
+
+    Call `frame` once per frame. The first `warmup` frames are ignored.
+    Tracing memory slows everything down, so this is only meant for
+    measuring.
+    """
+
+    def __init__(self, warmup=60):
+        self.warmup = warmup
+        self.frames = 0
+        self.net_bytes = 0
+        self.max_peak_bytes = 0
+        self.peak_bytes = 0
+        self.collections = 0
+        self.gc_time = 0
+        self._gc_start = 0
+        self._last = None
+        tracemalloc.start()
+        gc.callbacks.append(self._on_gc)
+
+    def _on_gc(self, phase, info):
+        if self.frames <= self.warmup:
+            return
+        if phase == 'start':
+            self._gc_start = time.perf_counter()
+        else:
+            self.collections += 1
+            self.gc_time += time.perf_counter() - self._gc_start
+
+    def frame(self):
+        """
+        Closes the measurement of the last frame and starts the next one.
+
+        :return: {None}
+        """
+        current, peak = tracemalloc.get_traced_memory()
+        if self._last is not None and self.frames > self.warmup:
+            self.net_bytes += current - self._last
+            self.peak_bytes += peak - self._last
+            self.max_peak_bytes = max(self.max_peak_bytes, peak - self._last)
+        self.frames += 1
+        tracemalloc.reset_peak()
+        self._last = tracemalloc.get_traced_memory()[0]
+
+    def stop(self):
+        gc.callbacks.remove(self._on_gc)
+        tracemalloc.stop()
+
+    def report(self):
+        """
+        :return: {str} averages over all measured frames
+        """
+        frames = max(1, self.frames - self.warmup - 1)
+        return (
+            '{} frames: {:.1f} B net and {:.1f} B peak per frame (max {} B), '
+            '{} gc collections taking {:.2f} ms'.format(
+                frames, self.net_bytes / frames, self.peak_bytes / frames,
+                self.max_peak_bytes, self.collections, self.gc_time * 1000
+            )
+        )